@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""Load benchmark for serve_spa_preview.py.
+- Builds a synthetic Vite-like dist (index.html, hashed JS/CSS chunks, images, a large MP4)
+- Starts the preview server on an ephemeral port with any server flags (after `--`)
+- Drives keep-alive and connection-per-request clients over a mix of asset hits,
+  SPA-fallback routes, 404s and MP4 range reads
+- Reports req/s, p50/p95/p99 latency and server peak RSS as JSON
+- --compare fails when throughput or p99 regress past --max-regression
+
+Example:
+  python bench_spa_preview.py --connections 64 --duration 15 --out bench.json -- --engine asyncio --index
+"""
+
+from __future__ import annotations
+
+import argparse
+import http.client
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+SERVER_SCRIPT = Path(__file__).resolve().parent / "serve_spa_preview.py"
+BANNER_RE = re.compile(r"running on http://([^:]+):(\d+)")
+
+# Request mix: (kind, weight). Asset hits dominate a real page load.
+MIX = (("asset", 70), ("fallback", 15), ("not_found", 10), ("media", 5))
+FALLBACK_ROUTES = ("/dashboard", "/protect", "/grow", "/execute", "/govern", "/settings", "/govern/audit/42")
+MEDIA_RANGE_BYTES = 1024 * 1024
+
+
+def build_fixture(root: Path, *, chunks: int = 40, images: int = 12, video_mb: int = 32, seed: int = 7) -> dict:
+    """Write a synthetic dist under root and return the URL lists to request."""
+    rng = random.Random(seed)
+    assets = root / "assets"
+    assets.mkdir(parents=True, exist_ok=True)
+    (root / "media").mkdir(exist_ok=True)
+
+    def name(stem: str, ext: str) -> str:
+        digest = "".join(rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_-") for _ in range(8))
+        return f"assets/{stem}-{digest}.{ext}"
+
+    urls: list[str] = []
+    for i in range(chunks):
+        # Mostly small route chunks, a few large vendor chunks.
+        size = rng.choice((2, 4, 8, 16, 32, 64)) * 1024 if i % 10 else rng.choice((180, 320)) * 1024
+        rel = name("index" if i == 0 else f"chunk{i}", "js")
+        line = f"export const v{i}=" + json.dumps("x" * 60) + ";\n"
+        (root / rel).write_text(line * (size // len(line) + 1))
+        urls.append("/" + rel)
+    entry_js = urls[0]
+    css = name("index", "css")
+    (root / css).write_text(".card{display:flex;gap:8px;color:#0b1f3a}\n" * 800)
+    urls.append("/" + css)
+    for i in range(images):
+        rel = name(f"slide{i:02d}", "png")
+        (root / rel).write_bytes(b"\x89PNG\r\n\x1a\n" + os.urandom(rng.choice((40, 120, 480)) * 1024))
+        urls.append("/" + rel)
+
+    with open(root / "media" / "demo.mp4", "wb") as f:
+        block = os.urandom(1024 * 1024)
+        for _ in range(video_mb):
+            f.write(block)
+
+    (root / "index.html").write_text(
+        "<!doctype html><html><head><meta charset=\"utf-8\">"
+        f"<script type=\"module\" crossorigin src=\"{entry_js}\"></script>"
+        f"<link rel=\"stylesheet\" crossorigin href=\"/{css}\"></head>"
+        "<body><div id=\"root\"></div></body></html>\n"
+    )
+    return {"asset": urls, "media_size": video_mb * 1024 * 1024}
+
+
+def start_server(root: Path, server_args: list[str]) -> tuple[subprocess.Popen, str, int]:
+    cmd = [sys.executable, str(SERVER_SCRIPT), "--root", str(root), "--port", "0", "--quiet", *server_args]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        line = proc.stdout.readline()
+        if not line:
+            break
+        match = BANNER_RE.search(line)
+        if match:
+            # Keep draining so the server never blocks on a full pipe.
+            threading.Thread(target=proc.stdout.read, daemon=True).start()
+            return proc, match.group(1), int(match.group(2))
+    proc.kill()
+    raise SystemExit(f"Server did not start: {' '.join(cmd)}")
+
+
+def peak_rss_kb(pid: int) -> int:
+    """Sum of VmHWM over pid and its descendants (Linux /proc); 0 elsewhere."""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            status = Path(f"/proc/{current}/status").read_text()
+        except OSError:
+            continue
+        match = re.search(r"^VmHWM:\s+(\d+)", status, re.M)
+        total += int(match.group(1)) if match else 0
+        for task in Path(f"/proc/{current}/task").glob("*/children"):
+            pending += [int(child) for child in task.read_text().split()]
+    return total
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(q / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[rank]
+
+
+def latency_summary(latencies_ms: list[float]) -> dict[str, float]:
+    ordered = sorted(latencies_ms)
+    return {
+        "p50": round(percentile(ordered, 50), 3),
+        "p95": round(percentile(ordered, 95), 3),
+        "p99": round(percentile(ordered, 99), 3),
+        "max": round(ordered[-1], 3) if ordered else 0.0,
+        "mean": round(sum(ordered) / len(ordered), 3) if ordered else 0.0,
+    }
+
+
+def _pick(rng: random.Random, plan: dict) -> tuple[str, str, dict[str, str]]:
+    kind = rng.choices([k for k, _ in MIX], weights=[w for _, w in MIX])[0]
+    if kind == "asset":
+        return kind, rng.choice(plan["asset"]), {}
+    if kind == "fallback":
+        return kind, rng.choice(FALLBACK_ROUTES), {}
+    if kind == "not_found":
+        return kind, f"/assets/missing-{rng.randrange(10**6)}.js", {}
+    start = rng.randrange(0, plan["media_size"] - MEDIA_RANGE_BYTES)
+    return kind, "/media/demo.mp4", {"Range": f"bytes={start}-{start + MEDIA_RANGE_BYTES - 1}"}
+
+
+def _client(host: str, port: int, plan: dict, keep_alive: bool, deadline: float, seed: int, out: list) -> None:
+    rng = random.Random(seed)
+    conn = None
+    while time.monotonic() < deadline:
+        kind, path, headers = _pick(rng, plan)
+        if not keep_alive:
+            headers["Connection"] = "close"
+        started = time.perf_counter()
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection(host, port, timeout=30)
+            conn.request("GET", path, headers=headers)
+            response = conn.getresponse()
+            size = len(response.read())
+            status = response.status
+            if not keep_alive or response.will_close:
+                conn.close()
+                conn = None
+        except (OSError, http.client.HTTPException):
+            if conn is not None:
+                conn.close()
+            conn = None
+            status, size = 0, 0
+        out.append((kind, status, (time.perf_counter() - started) * 1000, size))
+
+
+def run_client_process(host: str, port: int, plan: dict, keep_alive: int, close: int, duration: float, seed: int) -> list:
+    """One load process: keep_alive + close client threads for duration seconds."""
+    deadline = time.monotonic() + duration
+    results: list = []
+    threads = [
+        threading.Thread(target=_client, args=(host, port, plan, i < keep_alive, deadline, seed * 1000 + i, results))
+        for i in range(keep_alive + close)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def _split(total: int, parts: int) -> list[int]:
+    return [total // parts + (1 if i < total % parts else 0) for i in range(parts)]
+
+
+def run_benchmark(args: argparse.Namespace, server_args: list[str]) -> dict:
+    with tempfile.TemporaryDirectory(prefix="spa-bench-") as tmp:
+        root = Path(tmp) / "dist"
+        plan = build_fixture(root, video_mb=args.video_mb)
+        proc, host, port = start_server(root, server_args)
+        try:
+            # Warm up page cache and any server-side caches before measuring.
+            run_client_process(host, port, plan, 4, 0, args.warmup, 0)
+            keep_alive = round(args.connections * args.keep_alive_ratio)
+            procs = max(1, min(args.client_procs, args.connections))
+            started = time.monotonic()
+            with ProcessPoolExecutor(max_workers=procs) as pool:
+                futures = [
+                    pool.submit(run_client_process, host, port, plan, ka, cl, args.duration, i + 1)
+                    for i, (ka, cl) in enumerate(zip(_split(keep_alive, procs), _split(args.connections - keep_alive, procs)))
+                ]
+                results = [row for future in futures for row in future.result()]
+            elapsed = time.monotonic() - started
+            rss = peak_rss_kb(proc.pid)
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    ok = [row for row in results if row[1] and row[1] < 500]
+    status_counts: dict[str, int] = {}
+    for _, status, _, _ in results:
+        status_counts[str(status or "error")] = status_counts.get(str(status or "error"), 0) + 1
+    by_kind = {
+        kind: {"requests": len(rows), **latency_summary([row[2] for row in rows])}
+        for kind in (k for k, _ in MIX)
+        if (rows := [row for row in ok if row[0] == kind])
+    }
+    return {
+        "server_args": server_args,
+        "connections": args.connections,
+        "keep_alive_ratio": args.keep_alive_ratio,
+        "duration_s": round(elapsed, 3),
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "req_per_s": round(len(ok) / elapsed, 1),
+        "mb_per_s": round(sum(row[3] for row in ok) / elapsed / 1e6, 2),
+        "latency_ms": latency_summary([row[2] for row in ok]),
+        "by_kind": by_kind,
+        "status_counts": status_counts,
+        "server_peak_rss_kb": rss,
+    }
+
+
+def compare(report: dict, baseline: dict, max_regression: float) -> list[str]:
+    """Return human-readable regressions of report against baseline."""
+    problems = []
+    if report["req_per_s"] < baseline["req_per_s"] * (1 - max_regression):
+        problems.append(f"req/s {report['req_per_s']} < baseline {baseline['req_per_s']}")
+    for q in ("p50", "p99"):
+        now, before = report["latency_ms"][q], baseline["latency_ms"][q]
+        if now > before * (1 + max_regression):
+            problems.append(f"{q} {now}ms > baseline {before}ms")
+    return problems
+
+
+def main() -> int:
+    argv = sys.argv[1:]
+    server_args = argv[argv.index("--") + 1 :] if "--" in argv else []
+    bench_argv = argv[: argv.index("--")] if "--" in argv else argv
+
+    parser = argparse.ArgumentParser(description="Benchmark serve_spa_preview.py (server flags go after --)")
+    parser.add_argument("--connections", type=int, default=32, help="Concurrent clients (default: 32)")
+    parser.add_argument(
+        "--keep-alive-ratio",
+        type=float,
+        default=0.5,
+        help="Fraction of clients reusing connections; the rest reconnect per request (default: 0.5)",
+    )
+    parser.add_argument("--duration", type=float, default=10.0, help="Measured seconds (default: 10)")
+    parser.add_argument("--warmup", type=float, default=1.0, help="Unmeasured warm-up seconds (default: 1)")
+    parser.add_argument(
+        "--client-procs",
+        type=int,
+        default=max(1, (os.cpu_count() or 2) // 2),
+        help="Load-generator processes, so the client is not GIL-bound (default: half the CPUs)",
+    )
+    parser.add_argument("--video-mb", type=int, default=32, help="Size of the fixture MP4 in MiB (default: 32)")
+    parser.add_argument("--out", help="Write the JSON report here as well as stdout")
+    parser.add_argument("--compare", help="Baseline report to check for regressions")
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.2,
+        help="Allowed relative drop in req/s or rise in p50/p99 before --compare fails (default: 0.2)",
+    )
+    args = parser.parse_args(bench_argv)
+
+    report = run_benchmark(args, server_args)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        Path(args.out).write_text(text + "\n")
+    print(text)
+    if args.compare:
+        problems = compare(report, json.loads(Path(args.compare).read_text()), args.max_regression)
+        for problem in problems:
+            print(f"REGRESSION: {problem}", file=sys.stderr)
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
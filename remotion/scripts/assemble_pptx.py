@@ -5,6 +5,7 @@ Run from repo root: python scripts/assemble_pptx.py [--input output/jpeg]
 Requires: pip install python-pptx
 Input: output/png/*.png or output/jpeg/*.jpg
 Output: output/poseidon-mit-capstone-final.pptx
+--jpeg converts PNG input with Pillow (any OS) or macOS sips; see image_transcode.py
 """
 
 from __future__ import annotations
@@ -12,8 +13,6 @@ from __future__ import annotations
 import argparse
 import json
 from pathlib import Path
-import shutil
-import subprocess
 import tempfile
 from typing import Optional, Tuple
 
@@ -26,6 +25,8 @@ except ImportError:
     print("Run: pip install python-pptx")
     raise SystemExit(1)
 
+from image_transcode import BACKENDS, JPEG_SUBSAMPLING, TRANSCODE_ERRORS, TranscodeOptions, get_backend, transcode
+
 REPO_ROOT = Path(__file__).resolve().parent.parent
 OUTPUT_PPTX = REPO_ROOT / "output" / "poseidon-mit-capstone-final.pptx"
 DEBUG_PPTX_LOG = REPO_ROOT / "output" / "debug-pptx.ndjson"
@@ -86,27 +87,11 @@ def clamp_jpeg_quality(raw_quality: int) -> int:
     return max(1, min(100, raw_quality))
 
 
-def has_sips() -> bool:
-    return shutil.which("sips") is not None
-
-
-def convert_png_to_jpeg(png_path: Path, quality: int, temp_dir: Path) -> Path | None:
+def convert_png_to_jpeg(png_path: Path, options: TranscodeOptions, backend: str, temp_dir: Path) -> Path | None:
     jpg_path = temp_dir / f"{png_path.stem}.jpg"
-    cmd = [
-        "sips",
-        "-s",
-        "format",
-        "jpeg",
-        "-s",
-        "formatOptions",
-        str(quality),
-        str(png_path),
-        "--out",
-        str(jpg_path),
-    ]
     try:
-        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
-    except (subprocess.CalledProcessError, OSError) as err:
+        transcode(png_path, jpg_path, options, backend)
+    except TRANSCODE_ERRORS as err:
         print(f"⚠ JPEG conversion failed for {png_path.name}: {err}")
         return None
     return jpg_path if jpg_path.exists() else None
@@ -155,6 +140,19 @@ def main():
         default=92,
         help='JPEG quality (1-100) when --jpeg conversion is explicitly enabled.',
     )
+    parser.add_argument(
+        '--jpeg-subsampling',
+        choices=list(JPEG_SUBSAMPLING),
+        default='4:2:0',
+        help='JPEG chroma subsampling; 4:4:4 keeps small text crisp (pillow backend).',
+    )
+    parser.add_argument('--progressive', action='store_true', help='Write progressive JPEGs (pillow backend).')
+    parser.add_argument(
+        '--backend',
+        choices=BACKENDS,
+        default='auto',
+        help='Image conversion backend: pillow (in-process), sips (macOS), or auto (pillow if installed).',
+    )
     parser.add_argument(
         '--transitions',
         action='store_true',
@@ -197,9 +195,20 @@ def main():
     print(f"\nAssembling PPTX from {image_dir} ({extension} files)...")
     print(f"Options: jpeg={args.jpeg} quality={jpeg_quality}, notes={args.notes}, alt_text={args.alt_text}, transitions={args.transitions}")
 
-    sips_available = has_sips()
-    if args.jpeg and extension == '.png' and not sips_available:
-        print("⚠ 'sips' not found. PNG files will be embedded directly.")
+    backend = None
+    if args.jpeg and extension == '.png':
+        try:
+            backend = get_backend(args.backend).name
+        except RuntimeError as err:
+            print(f"✗ --jpeg cannot convert on this machine: {err}")
+            raise SystemExit(1)
+        print(f"JPEG conversion backend: {backend}")
+    options = TranscodeOptions(
+        image_format='jpeg',
+        jpeg_quality=jpeg_quality,
+        jpeg_subsampling=args.jpeg_subsampling,
+        progressive=args.progressive,
+    )
 
     with tempfile.TemporaryDirectory(prefix="poseidon-assemble-jpeg-") as tmp:
         tmp_dir = Path(tmp)
@@ -231,8 +240,8 @@ def main():
                     pass
 
                 source_path = path
-                if extension == '.png' and args.jpeg and sips_available:
-                    maybe_jpg = convert_png_to_jpeg(path, jpeg_quality, tmp_dir)
+                if backend is not None:
+                    maybe_jpg = convert_png_to_jpeg(path, options, backend, tmp_dir)
                     if maybe_jpg is not None:
                         source_path = maybe_jpg
                     else:
@@ -10,15 +10,19 @@ Defaults are quality-first (master profile):
 Optional delivery profile:
 - Convert source PNG files to JPEG (`--image-format jpeg`)
 - Optional max dimension clamp (`--max-dimension`)
+- Slides are transcoded before assembly, in parallel with `--jobs N`
+- Conversion runs in-process with Pillow on any OS (`--backend pillow`) or
+  through macOS `sips` (`--backend sips`); see image_transcode.py
 """
 
 from __future__ import annotations
 
 import argparse
 import json
-import shutil
-import subprocess
+import os
 import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
@@ -31,6 +35,8 @@ except ImportError:
     print("Run: pip install python-pptx")
     raise SystemExit(1)
 
+from image_transcode import BACKENDS, JPEG_SUBSAMPLING, TranscodeOptions, get_backend, transcode
+
 TITLE_FOR = {
     "v3-Slide01TitleV3.png": "Slide 1 — The Guardian Arrives",
     "v3-Slide02ProblemV3.png": "Slide 2 — The Coordination Gap",
@@ -108,12 +114,35 @@ def parse_args() -> argparse.Namespace:
         default=82,
         help="JPEG quality (1-100) when --image-format jpeg.",
     )
+    parser.add_argument(
+        "--jpeg-subsampling",
+        choices=list(JPEG_SUBSAMPLING),
+        default="4:2:0",
+        help="JPEG chroma subsampling; 4:4:4 keeps small text crisp (pillow backend).",
+    )
+    parser.add_argument(
+        "--progressive",
+        action="store_true",
+        help="Write progressive JPEGs (pillow backend).",
+    )
     parser.add_argument(
         "--max-dimension",
         type=int,
         default=None,
         help="Optional max image dimension (long side) before embedding.",
     )
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default="auto",
+        help="Image conversion backend: pillow (in-process), sips (macOS), or auto (pillow if installed).",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Transcode this many slides in parallel (0 = one per CPU; default: 1).",
+    )
     parser.add_argument(
         "--output",
         type=Path,
@@ -193,24 +222,39 @@ def set_speaker_notes(slide, text: str) -> None:
         print(f"WARNING: Failed to set speaker notes: {err}")
 
 
-def convert_with_sips(
-    input_path: Path,
-    output_path: Path,
-    image_format: str,
-    jpeg_quality: int,
-    max_dimension: int | None,
-) -> None:
-    if shutil.which("sips") is None:
-        raise RuntimeError("sips is required for JPEG conversion or max-dimension scaling on macOS.")
-    cmd = ["sips"]
-    if max_dimension is not None:
-        cmd += ["-Z", str(max_dimension)]
-    if image_format == "jpeg":
-        cmd += ["-s", "format", "jpeg", "-s", "formatOptions", str(jpeg_quality)]
-    else:
-        cmd += ["-s", "format", "png"]
-    cmd += [str(input_path), "--out", str(output_path)]
-    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+def transcode_slide(input_path: Path, output_path: Path, options: TranscodeOptions, backend: str) -> float:
+    """Convert one slide image; return the seconds it took."""
+    started = time.perf_counter()
+    transcode(input_path, output_path, options, backend)
+    return time.perf_counter() - started
+
+
+def transcode_slides(
+    jobs: list[tuple[Path, Path]],
+    options: TranscodeOptions,
+    backend: str,
+    workers: int,
+) -> list[float]:
+    """Convert every (input, output) pair; return per-image seconds in job order."""
+    if workers <= 1 or len(jobs) <= 1:
+        return [transcode_slide(source, target, options, backend) for source, target in jobs]
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+        futures = [pool.submit(transcode_slide, source, target, options, backend) for source, target in jobs]
+        # Collected in submission order, whatever order they finish in.
+        return [future.result() for future in futures]
+
+
+def print_transcode_summary(jobs: list[tuple[Path, Path]], timings: list[float], wall: float) -> None:
+    print("Transcode timings:")
+    for (source, target), seconds in zip(jobs, timings):
+        before_kb = source.stat().st_size / 1024
+        after_kb = target.stat().st_size / 1024
+        print(f"  {source.name}: {seconds:.2f}s ({before_kb:.0f} KB -> {after_kb:.0f} KB)")
+    total = sum(timings)
+    print(
+        f"  total {total:.2f}s of work in {wall:.2f}s wall "
+        f"(slowest {max(timings):.2f}s, mean {total / len(timings):.2f}s)"
+    )
 
 
 def detect_profile_name(args: argparse.Namespace) -> str:
@@ -260,25 +304,34 @@ def main() -> None:
     blank = prs.slide_layouts[6]
 
     needs_processing = args.image_format == "jpeg" or args.max_dimension is not None
+    workers = args.jobs if args.jobs > 0 else os.cpu_count() or 1
+    backend = None
+    if needs_processing:
+        try:
+            backend = get_backend(args.backend).name
+        except RuntimeError as err:
+            print(f"ERROR: {err}")
+            raise SystemExit(1)
+    options = TranscodeOptions(
+        image_format=args.image_format,
+        jpeg_quality=jpeg_quality,
+        max_dimension=args.max_dimension,
+        jpeg_subsampling=args.jpeg_subsampling,
+        progressive=args.progressive,
+    )
     with tempfile.TemporaryDirectory(prefix="poseidon-v3-pptx-") as tmp:
         tmp_dir = Path(tmp)
 
-        for index, name in enumerate(slide_pngs):
-            source_png = out_dir / name
-            source_image = source_png
-
-            if needs_processing:
-                out_ext = ".jpg" if args.image_format == "jpeg" else ".png"
-                processed = tmp_dir / f"{source_png.stem}{out_ext}"
-                convert_with_sips(
-                    input_path=source_png,
-                    output_path=processed,
-                    image_format=args.image_format,
-                    jpeg_quality=jpeg_quality,
-                    max_dimension=args.max_dimension,
-                )
-                source_image = processed
+        slide_images = [out_dir / name for name in slide_pngs]
+        if needs_processing:
+            out_ext = ".jpg" if args.image_format == "jpeg" else ".png"
+            jobs = [(source, tmp_dir / f"{source.stem}{out_ext}") for source in slide_images]
+            started = time.perf_counter()
+            timings = transcode_slides(jobs, options, backend, workers)
+            print_transcode_summary(jobs, timings, time.perf_counter() - started)
+            slide_images = [target for _, target in jobs]
 
+        for index, (name, source_image) in enumerate(zip(slide_pngs, slide_images)):
             slide = prs.slides.add_slide(blank)
             picture = slide.shapes.add_picture(
                 str(source_image),
@@ -309,7 +362,11 @@ def main() -> None:
         f"profile={profile}, "
         f"image_format={args.image_format}, "
         f"jpeg_quality={jpeg_quality}, "
+        f"jpeg_subsampling={args.jpeg_subsampling}, "
+        f"progressive={args.progressive}, "
         f"max_dimension={args.max_dimension}, "
+        f"backend={backend or 'none'}, "
+        f"jobs={workers}, "
         f"notes={args.notes}, "
         f"alt_text={args.alt_text}, "
         f"transitions={args.transitions}"
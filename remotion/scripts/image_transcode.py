@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Image transcode backends shared by the PPTX assembly scripts.
+
+Backends:
+- pillow: in-process (Linux and macOS); one decode per image, downscaled in
+  place with Lanczos, JPEG with quality/subsampling/progressive options,
+  optimized PNG. Requires: pip install Pillow
+- sips: macOS `sips` subprocess per image (JPEG quality and max dimension only)
+- auto (default): pillow when installed, otherwise sips
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+import subprocess
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+
+try:
+    from PIL import Image, UnidentifiedImageError
+except ImportError:  # Optional: the sips backend needs no Python packages.
+    Image = None
+    UnidentifiedImageError = None
+
+BACKENDS = ("auto", "pillow", "sips")
+# What a backend raises for an unreadable or unconvertible image, as opposed
+# to a bug; callers that skip bad images catch these and nothing broader.
+TRANSCODE_ERRORS: tuple[type[Exception], ...] = (OSError, subprocess.CalledProcessError)
+if UnidentifiedImageError is not None:
+    TRANSCODE_ERRORS += (UnidentifiedImageError,)
+# Chroma subsampling names as Pillow's JPEG encoder numbers them.
+JPEG_SUBSAMPLING = {"4:4:4": 0, "4:2:2": 1, "4:2:0": 2}
+
+
+@dataclass(frozen=True)
+class TranscodeOptions:
+    image_format: str = "png"
+    jpeg_quality: int = 82
+    max_dimension: int | None = None
+    jpeg_subsampling: str = "4:2:0"
+    progressive: bool = False
+
+
+class PillowBackend:
+    name = "pillow"
+
+    def transcode(self, input_path: Path, output_path: Path, options: TranscodeOptions) -> None:
+        with Image.open(input_path) as image:
+            if options.max_dimension is not None:
+                # JPEG sources decode straight at a reduced DCT scale when possible.
+                image.draft(image.mode, (options.max_dimension, options.max_dimension))
+            image.load()
+            if options.max_dimension is not None:
+                # In place on the decoded buffer; reducing_gap box-reduces by an
+                # integer factor first so Lanczos only runs on the last step.
+                resample = getattr(Image, "Resampling", Image).LANCZOS
+                image.thumbnail((options.max_dimension, options.max_dimension), resample, reducing_gap=3.0)
+            if options.image_format == "jpeg":
+                image = flatten_for_jpeg(image)
+                save_options = {
+                    "quality": options.jpeg_quality,
+                    "subsampling": JPEG_SUBSAMPLING[options.jpeg_subsampling],
+                    "progressive": options.progressive,
+                    "optimize": True,
+                }
+                image.save(output_path, "JPEG", **save_options)
+            else:
+                image.save(output_path, "PNG", optimize=True)
+
+
+class SipsBackend:
+    name = "sips"
+
+    def transcode(self, input_path: Path, output_path: Path, options: TranscodeOptions) -> None:
+        cmd = ["sips"]
+        if options.max_dimension is not None:
+            cmd += ["-Z", str(options.max_dimension)]
+        if options.image_format == "jpeg":
+            cmd += ["-s", "format", "jpeg", "-s", "formatOptions", str(options.jpeg_quality)]
+        else:
+            cmd += ["-s", "format", "png"]
+        cmd += [str(input_path), "--out", str(output_path)]
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+
+
+def flatten_for_jpeg(image):
+    """JPEG has no alpha: composite transparent pixels onto white, like sips does."""
+    if image.mode in ("RGB", "L"):
+        return image
+    if image.mode in ("RGBA", "LA", "P"):
+        rgba = image.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def available_backends() -> list[str]:
+    names = []
+    if Image is not None:
+        names.append("pillow")
+    if shutil.which("sips") is not None:
+        names.append("sips")
+    return names
+
+
+@lru_cache(maxsize=None)
+def get_backend(name: str = "auto") -> PillowBackend | SipsBackend:
+    """Return the named backend, raising RuntimeError when it cannot run here."""
+    if name == "auto":
+        names = available_backends()
+        if not names:
+            raise RuntimeError("Image conversion needs Pillow (pip install Pillow) or macOS sips.")
+        name = names[0]
+    if name == "pillow":
+        if Image is None:
+            raise RuntimeError("The pillow backend needs Pillow: pip install Pillow")
+        return PillowBackend()
+    if name == "sips":
+        if shutil.which("sips") is None:
+            raise RuntimeError("The sips backend is only available on macOS.")
+        return SipsBackend()
+    raise ValueError(f"Unknown image backend: {name} (choose from {', '.join(BACKENDS)})")
+
+
+def transcode(
+    input_path: Path,
+    output_path: Path,
+    options: TranscodeOptions,
+    backend: str = "auto",
+) -> None:
+    """Write a converted copy of input_path; output_path only appears once complete."""
+    tmp_path = output_path.with_name(f"{output_path.stem}.{os.getpid()}.tmp{output_path.suffix}")
+    try:
+        get_backend(backend).transcode(input_path, tmp_path, options)
+        os.replace(tmp_path, output_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
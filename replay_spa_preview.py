@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""Replay request traces recorded by serve_spa_preview.py --record.
+- Reads one or more trace files (.gz or plain); per-worker traces from
+  --processes are merged on their recorded start times
+- Starts the preview server on --root with any server flags (after `--`),
+  or targets an already running server with --url
+- Replays at the recorded pace scaled by --speed (0 sends back to back) over
+  --concurrency keep-alive connections
+- Reports latency percentiles, error rate, status counts and how far the
+  client fell behind the schedule as JSON
+- --compare reports latency and error-rate differences against an earlier
+  report and fails past --max-regression / --max-error-increase
+
+Example:
+  python serve_spa_preview.py --record trace.jsonl.gz   # then run Playwright or Lighthouse
+  python replay_spa_preview.py trace.jsonl.gz --root dist --speed 4 --out threaded.json
+  python replay_spa_preview.py trace.jsonl.gz --root dist --speed 4 --compare threaded.json -- --engine asyncio
+"""
+
+from __future__ import annotations
+
+import argparse
+import gzip
+import http.client
+import json
+import posixpath
+import queue
+import subprocess
+import sys
+import threading
+import time
+import zlib
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from bench_spa_preview import latency_summary, peak_rss_kb, start_server
+
+# One trace event: (seconds since the earliest trace start, method, target, headers).
+Event = tuple[float, str, str, dict[str, str]]
+
+
+def load_trace(paths: list[Path]) -> list[Event]:
+    """Read trace files into one timeline, ordered by recorded arrival."""
+    timelines = []
+    for path in paths:
+        opener = gzip.open if path.suffix == ".gz" else open
+        events = []
+        t0 = None
+        at = 0.0
+        try:
+            with opener(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    row = json.loads(line)
+                    if isinstance(row, dict):
+                        # A header starts each recording session appended to the file.
+                        t0, at = row["t0"], 0.0
+                        continue
+                    at += row[0] / 1000
+                    events.append((t0 + at, row[1], row[2], row[3] if len(row) > 3 else {}))
+        except (EOFError, zlib.error):
+            # The server was killed mid-write; keep what was flushed.
+            pass
+        timelines.append(events)
+    merged = sorted((event for events in timelines for event in events), key=lambda event: event[0])
+    if not merged:
+        return []
+    start = merged[0][0]
+    return [(at - start, method, target, headers) for at, method, target, headers in merged]
+
+
+def _kind(target: str) -> str:
+    return "asset" if posixpath.splitext(urlsplit(target).path)[1] else "route"
+
+
+def _worker(host: str, port: int, jobs: queue.Queue, out: list) -> None:
+    conn = None
+    while (job := jobs.get()) is not None:
+        due, (_, method, target, headers) = job
+        started = time.perf_counter()
+        lag = max(0.0, time.monotonic() - due)
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection(host, port, timeout=30)
+            conn.request(method, target, headers=headers)
+            response = conn.getresponse()
+            size = len(response.read())
+            status = response.status
+            if response.will_close:
+                conn.close()
+                conn = None
+        except (OSError, http.client.HTTPException):
+            if conn is not None:
+                conn.close()
+            conn = None
+            status, size = 0, 0
+        out.append((_kind(target), status, (time.perf_counter() - started) * 1000, size, lag * 1000))
+    if conn is not None:
+        conn.close()
+
+
+def replay(host: str, port: int, events: list[Event], speed: float, concurrency: int) -> tuple[list, float]:
+    """Send events on schedule from concurrency connections; return results and elapsed seconds."""
+    jobs: queue.Queue = queue.Queue()
+    results: list = []
+    threads = [threading.Thread(target=_worker, args=(host, port, jobs, results)) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    started = time.monotonic()
+    for event in events:
+        due = started + (event[0] / speed if speed > 0 else 0.0)
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        jobs.put((due, event))
+    for _ in threads:
+        jobs.put(None)
+    for thread in threads:
+        thread.join()
+    return results, time.monotonic() - started
+
+
+def build_report(results: list, elapsed: float) -> dict:
+    ok = [row for row in results if row[1] and row[1] < 500]
+    status_counts: dict[str, int] = {}
+    for _, status, _, _, _ in results:
+        status_counts[str(status or "error")] = status_counts.get(str(status or "error"), 0) + 1
+    by_kind = {
+        kind: {"requests": len(rows), **latency_summary([row[2] for row in rows])}
+        for kind in ("asset", "route")
+        if (rows := [row for row in ok if row[0] == kind])
+    }
+    return {
+        "duration_s": round(elapsed, 3),
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "error_rate": round((len(results) - len(ok)) / len(results), 4) if results else 0.0,
+        "latency_ms": latency_summary([row[2] for row in ok]),
+        "by_kind": by_kind,
+        "status_counts": status_counts,
+        # Time requests waited for a free connection; high values mean the
+        # replay could not keep the recorded pace, so raise --concurrency.
+        "schedule_lag_ms": latency_summary([row[4] for row in results]),
+    }
+
+
+def diff_reports(report: dict, baseline: dict) -> dict:
+    """Latency and error-rate differences of report against baseline (positive is worse)."""
+    latency = {}
+    for q in ("p50", "p95", "p99", "mean"):
+        now, before = report["latency_ms"][q], baseline["latency_ms"][q]
+        latency[q] = {
+            "ms": round(now - before, 3),
+            "ratio": round(now / before - 1, 3) if before else None,
+        }
+    statuses = set(report["status_counts"]) | set(baseline["status_counts"])
+    return {
+        "latency_ms": latency,
+        "error_rate": round(report["error_rate"] - baseline["error_rate"], 4),
+        "status_counts": {
+            status: report["status_counts"].get(status, 0) - baseline["status_counts"].get(status, 0)
+            for status in sorted(statuses)
+            if report["status_counts"].get(status, 0) != baseline["status_counts"].get(status, 0)
+        },
+    }
+
+
+def regressions(diff: dict, max_regression: float, max_error_increase: float) -> list[str]:
+    """Return human-readable regressions from a diff_reports() result."""
+    problems = []
+    for q in ("p50", "p99"):
+        ratio = diff["latency_ms"][q]["ratio"]
+        if ratio is not None and ratio > max_regression:
+            problems.append(f"{q} up {ratio:.0%} ({diff['latency_ms'][q]['ms']:+}ms)")
+    if diff["error_rate"] > max_error_increase:
+        problems.append(f"error rate up {diff['error_rate']:+.2%}")
+    return problems
+
+
+def main() -> int:
+    argv = sys.argv[1:]
+    server_args = argv[argv.index("--") + 1 :] if "--" in argv else []
+    replay_argv = argv[: argv.index("--")] if "--" in argv else argv
+
+    parser = argparse.ArgumentParser(description="Replay serve_spa_preview.py traces (server flags go after --)")
+    parser.add_argument("traces", nargs="+", type=Path, help="Trace files written by --record")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--root", type=Path, help="Start serve_spa_preview.py on this directory")
+    target.add_argument("--url", help="Replay against a running server, e.g. http://127.0.0.1:4173")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="Multiple of the recorded pace; 0 sends every request as soon as a connection is free (default: 1)",
+    )
+    parser.add_argument("--concurrency", type=int, default=8, help="Keep-alive client connections (default: 8)")
+    parser.add_argument("--out", help="Write the JSON report here as well as stdout")
+    parser.add_argument("--compare", help="Earlier report to diff against")
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.2,
+        help="Allowed relative rise in p50/p99 before --compare fails (default: 0.2)",
+    )
+    parser.add_argument(
+        "--max-error-increase",
+        type=float,
+        default=0.0,
+        help="Allowed absolute rise in error rate before --compare fails (default: 0)",
+    )
+    args = parser.parse_args(replay_argv)
+    if args.url and server_args:
+        parser.error("server flags after -- only apply with --root")
+
+    events = load_trace(args.traces)
+    if not events:
+        raise SystemExit("No requests in the trace")
+
+    proc = None
+    if args.url:
+        parts = urlsplit(args.url)
+        host, port = parts.hostname or "127.0.0.1", parts.port or 80
+    else:
+        proc, host, port = start_server(args.root, server_args)
+    try:
+        results, elapsed = replay(host, port, events, args.speed, max(1, args.concurrency))
+        rss = peak_rss_kb(proc.pid) if proc is not None else 0
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    report = {
+        "traces": [str(path) for path in args.traces],
+        "target": args.url or {"root": str(args.root), "server_args": server_args},
+        "speed": args.speed,
+        "concurrency": args.concurrency,
+        "recorded_s": round(events[-1][0], 3),
+        **build_report(results, elapsed),
+        "server_peak_rss_kb": rss,
+    }
+    problems = []
+    if args.compare:
+        report["vs_baseline"] = diff_reports(report, json.loads(Path(args.compare).read_text()))
+        problems = regressions(report["vs_baseline"], args.max_regression, args.max_error_increase)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        Path(args.out).write_text(text + "\n")
+    print(text)
+    for problem in problems:
+        print(f"REGRESSION: {problem}", file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
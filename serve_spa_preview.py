@@ -3,67 +3,3004 @@
 - Serves real static files when present
 - SPA fallback to index.html only for route-like paths
 - Returns 404 for missing asset files
-- Sends no-store cache headers to avoid stale hashed bundle issues
+- Sends no-store cache headers to avoid stale hashed bundle issues; with
+  --cache-policy immutable, hashed assets are cached for a year and other
+  files revalidate via ETag/Last-Modified (index.html stays no-store)
+- Optional in-memory LRU content cache (--cache-mb), revalidated by mtime/size
+- Streams large files with sendfile instead of buffering them in memory
+- Serves .br/.gz variants negotiated via Accept-Encoding (--precompress builds them)
+- --pack writes the root (and its variants) into one indexed archive;
+  --bundle serves that archive through mmap slices, with no per-file I/O
+- --resize-images answers ?w=/?h=/?q= on images with downscaled variants
+  (Pillow, in a process pool), cached on disk by source hash and parameters
+- Answers byte Range requests (206/416, single and multipart) for seekable media
+- Threaded engine by default; --engine asyncio serves the same site from an
+  asyncio streams server. Both keep HTTP/1.1 connections alive until idle
+- --index walks the root once at startup so routing and HEAD need no stat
+  calls; a cheap generation check picks up rebuilds
+- --metrics serves Prometheus metrics at /__metrics and adds Server-Timing
+- Access logs are JSON lines written by a background thread (--log-sample,
+  --log-file, --quiet); --record writes a request trace that
+  replay_spa_preview.py replays against any server mode
+- --workers bounds the threaded engine to a fixed pool and sheds load past
+  --queue-depth with 503 + Retry-After
+- Stalled or trickling clients are dropped by --header-timeout (whole
+  request head), --keep-alive-timeout (idle), --write-timeout (no progress)
+  and --min-rate, with drop counts per reason in the metrics
+- --preload-hints adds Link modulepreload/preload headers for the entry's
+  static imports (from Vite's build manifest or index.html) to SPA shell
+  responses; --early-hints also sends them ahead in a 103
+- --inline-kb inlines index.html's small stylesheets and scripts into a
+  shell variant built once per build and served from memory (still no-store)
+- --live-reload streams build-change events (Server-Sent Events, inotify
+  with a polling fallback) to a snippet injected into index.html
+- --snapshots pins each request to one complete build (symlink flip or
+  copied generations) and keeps older builds reachable for open tabs
+- --proxy PREFIX=URL forwards API routes to local backends over pooled
+  keep-alive connections, streaming responses back
+- --processes forks workers that share the port via SO_REUSEPORT, under a
+  supervisor that restarts them and forwards signals (SIGHUP restarts all)
+- --unix listens on a Unix domain socket; a listener passed by socket
+  activation (LISTEN_FDS) is adopted instead of binding. On shutdown the
+  listener closes first and in-flight responses get --drain-timeout to finish
+- --profile shapes responses to slow-3g/fast-3g/slow-4g or custom links
+  (per-connection token-bucket bandwidth plus first-byte latency), for all
+  routes or per route class, so Lighthouse runs see realistic transfers
 """
 
 from __future__ import annotations
 
 import argparse
+import asyncio
+import ctypes
+import email.utils
+import errno
+import gzip
+import hashlib
+import html
+import http
+import http.client
 import http.server
+import io
+import json
 import mimetypes
+import mmap
+import multiprocessing
 import os
 import posixpath
+import queue
+import random
+import re
+import secrets
+import select
+import shutil
+import signal
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from email.message import Message
+from html.parser import HTMLParser
 from pathlib import Path
-from urllib.parse import unquote, urlsplit
+from typing import BinaryIO, Callable, Iterator, TextIO
+from urllib.parse import parse_qs, unquote, urljoin, urlsplit
 
+try:
+    import brotli
+except ImportError:  # Optional: without it only gzip variants are generated.
+    brotli = None
 
-class SPAHandler(http.server.SimpleHTTPRequestHandler):
-    root: Path
+try:
+    from PIL import Image
+except ImportError:  # Optional: needed only for --resize-images.
+    Image = None
+
+# Content codings in server preference order, with their file suffixes.
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+COMPRESSIBLE_SUFFIXES = frozenset(
+    {".html", ".js", ".mjs", ".css", ".json", ".map", ".svg", ".txt", ".xml", ".webmanifest", ".wasm"}
+)
+# Below this size compression saves less than the framing costs.
+PRECOMPRESS_MIN_BYTES = 1024
+
+METRICS_PATH = "/__metrics"
+# Builds kept by --snapshots stay reachable as /__builds/<id>/<path>.
+BUILDS_PREFIX = "/__builds/"
+
+NO_STORE_HEADERS = (
+    ("Cache-Control", "no-store, no-cache, must-revalidate"),
+    ("Pragma", "no-cache"),
+    ("Expires", "0"),
+)
+# Representation headers a 304 must repeat (RFC 9110 section 15.4.5).
+NOT_MODIFIED_HEADERS = frozenset({"Cache-Control", "ETag", "Expires", "Last-Modified", "Vary"})
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Vite emits content-hashed files as assets/<name>-<hash>.<ext>, the hash
+# being 8 base64url characters. A last segment with "-" in it, or with no
+# digit or capital, reads as a name (inter-variable) and is left revalidating.
+FINGERPRINT_RE = re.compile(r"-(?=[a-z_]*[0-9A-Z])[A-Za-z0-9_]{8}$")
+
+
+def is_fingerprinted(rel_path: str) -> bool:
+    """True for names shaped like Vite content-hashed output, e.g. assets/index-B3x9kLq1.js.
+
+    Only a guess from the name; HashedFiles prefers the build manifest.
+    """
+    head, _, name = rel_path.rpartition("/")
+    if head.split("/", 1)[0] != "assets":
+        return False
+    stem = name.split(".", 1)[0]
+    return FINGERPRINT_RE.search(stem) is not None
+
+
+# More parts than this is not a media player seeking; just send the whole body.
+MAX_RANGE_PARTS = 32
+
+
+def parse_range(header: str, size: int) -> list[tuple[int, int]] | None:
+    """Parse a bytes Range header into sorted, merged inclusive spans.
+
+    Returns None when the header is malformed or not a byte range (serve the
+    full body) and an empty list when no span overlaps the file (416).
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+    parts = [part.strip() for part in spec.split(",") if part.strip()]
+    if len(parts) > MAX_RANGE_PARTS:
+        return None
+    spans: list[tuple[int, int]] = []
+    for part in parts:
+        first, sep, last = part.partition("-")
+        first, last = first.strip(), last.strip()
+        if not sep or (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+        if first:
+            start = int(first)
+            if last and int(last) < start:
+                return None
+            if start >= size:
+                continue
+            end = int(last) if last else size - 1
+            spans.append((start, min(end, size - 1)))
+        elif last:
+            suffix = int(last)
+            if suffix and size:
+                spans.append((max(0, size - suffix), size - 1))
+        else:
+            return None
+    merged: list[tuple[int, int]] = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def make_etag(st: os.stat_result | FileMeta) -> str:
+    """Strong validator for one on-disk representation (mtime and size)."""
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """Weak comparison as required for If-None-Match."""
+    if header.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in header.split(","))
+
+
+def parse_accept_encoding(header: str | None) -> dict[str, float]:
+    """Parse an Accept-Encoding header into {coding: q}."""
+    accepted: dict[str, float] = {}
+    if not header:
+        return accepted
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding == "x-gzip":
+            coding = "gzip"
+        accepted[coding] = q
+    return accepted
+
+
+def acceptable_encodings(header: str | None) -> list[tuple[str, str]]:
+    """Return the (coding, suffix) pairs the client accepts, best first."""
+    accepted = parse_accept_encoding(header)
+    wildcard = accepted.get("*", 0.0)
+    ranked = []
+    for rank, (coding, suffix) in enumerate(ENCODINGS):
+        q = accepted.get(coding, wildcard)
+        if q > 0:
+            ranked.append((-q, rank, coding, suffix))
+    return [(coding, suffix) for _, _, coding, suffix in sorted(ranked)]
+
+
+def find_precompressed(
+    target: Path,
+    root: Path,
+    cache_dir: Path | None,
+    encodings: list[tuple[str, str]],
+    stat: Callable[[Path], os.stat_result | FileMeta] = os.stat,
+) -> tuple[Path, str] | None:
+    """Find a fresh precompressed variant of target, as (path, coding).
+
+    Siblings next to the source (e.g. from a Vite compression plugin) win over
+    the --precompress cache directory. A variant older than its source is
+    ignored so a rebuild never serves stale bytes.
+    """
+    if not encodings:
+        return None
+    try:
+        source_mtime = stat(target).st_mtime_ns
+    except OSError:
+        return None
+    bases = [target]
+    if cache_dir is not None:
+        try:
+            bases.append(cache_dir / target.relative_to(root))
+        except ValueError:
+            pass
+    for coding, suffix in encodings:
+        for base in bases:
+            variant = base.with_name(base.name + suffix)
+            try:
+                st = stat(variant)
+            except OSError:
+                continue
+            if st.st_mtime_ns >= source_mtime:
+                return variant, coding
+    return None
+
+
+def default_precompress_dir(root: Path) -> Path:
+    digest = hashlib.sha1(str(root).encode()).hexdigest()[:12]
+    return Path(tempfile.gettempdir()) / "spa-preview-precompressed" / digest
+
+
+def default_image_cache_dir(root: Path) -> Path:
+    digest = hashlib.sha1(str(root).encode()).hexdigest()[:12]
+    return Path(tempfile.gettempdir()) / "spa-preview-images" / digest
+
+
+def default_snapshot_dir(root: Path) -> Path:
+    digest = hashlib.sha1(str(root).encode()).hexdigest()[:12]
+    return Path(tempfile.gettempdir()) / "spa-preview-builds" / digest
+
+
+def _compress_file(source: Path, root: Path, cache_dir: Path) -> int:
+    st = source.stat()
+    if st.st_size < PRECOMPRESS_MIN_BYTES:
+        return 0
+    data = source.read_bytes()
+    out_base = cache_dir / source.relative_to(root)
+    out_base.parent.mkdir(parents=True, exist_ok=True)
+    codecs = [(".gz", lambda raw: gzip.compress(raw, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        codecs.append((".br", lambda raw: brotli.compress(raw, quality=11)))
+    written = 0
+    for suffix, compress in codecs:
+        out = out_base.with_name(out_base.name + suffix)
+        try:
+            if out.stat().st_mtime_ns == st.st_mtime_ns:
+                continue
+        except OSError:
+            pass
+        packed = compress(data)
+        if len(packed) >= len(data):
+            continue
+        tmp = out.with_name(f"{out.name}.{os.getpid()}.tmp")
+        tmp.write_bytes(packed)
+        # Stamp the variant with the source mtime so reruns can skip it.
+        os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(tmp, out)
+        written += 1
+    return written
+
+
+def precompress_tree(root: Path, cache_dir: Path, jobs: int | None = None) -> int:
+    """Write .gz (and .br when available) variants of compressible files under root."""
+    sources = [
+        path
+        for path in root.rglob("*")
+        if path.suffix in COMPRESSIBLE_SUFFIXES and path.is_file()
+    ]
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+        return sum(pool.map(lambda path: _compress_file(path, root, cache_dir), sources))
+
+
+class _PendingRead:
+    """A file read in progress that concurrent cache misses can wait on."""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.data: bytes | None = None
+        self.error: OSError | None = None
+
+    def wait(self) -> bytes:
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        assert self.data is not None
+        return self.data
+
+
+class AssetCache:
+    """Byte-budgeted LRU of file contents keyed by resolved path.
+
+    Entries are checked against the file's current (mtime, size) on every
+    lookup, so a rebuild of dist is picked up without a restart. Concurrent
+    misses for the same path are coalesced into a single read.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[Path, tuple[tuple[int, int], bytes]] = OrderedDict()
+        self._pending: dict[Path, _PendingRead] = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def get(self, path: Path, st: os.stat_result | FileMeta | None = None) -> tuple[bytes, bool]:
+        """Return (data, hit) for path, reading it from disk on a miss.
+
+        ``st`` skips the validation stat when the caller already has current
+        metadata (e.g. from a FileIndex).
+        """
+        if st is None:
+            st = path.stat()
+        key = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == key:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[1], True
+            pending = self._pending.get(path)
+            owner = pending is None
+            if owner:
+                pending = self._pending[path] = _PendingRead()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            return pending.wait(), False
+
+        try:
+            with open(path, "rb") as f:
+                st = os.fstat(f.fileno())
+                data = f.read()
+        except OSError as exc:
+            pending.error = exc
+            raise
+        else:
+            pending.data = data
+            # Only cache what matches the stat we read against; a file that is
+            # being rewritten mid-read is served but not retained.
+            if len(data) == st.st_size:
+                self._store(path, (st.st_mtime_ns, st.st_size), data)
+            return data, False
+        finally:
+            with self._lock:
+                self._pending.pop(path, None)
+            pending.done.set()
+
+    def _store(self, path: Path, key: tuple[int, int], data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self._size -= len(old[1])
+            self._entries[path] = (key, data)
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
+
+
+@dataclass(frozen=True)
+class FileMeta:
+    """Indexed metadata for one file; quacks like the os.stat_result fields we use."""
+
+    st_size: int
+    st_mtime_ns: int
+    ctype: str
+    etag: str
+
+    @property
+    def st_mtime(self) -> float:
+        return self.st_mtime_ns / 1e9
+
+
+class FileIndex:
+    """In-memory index of every file under the served directories.
+
+    Built by one walk at startup so request routing is a dict lookup instead
+    of stat calls. A rebuild is detected by a generation check, at most once
+    per ``interval`` seconds, of index.html and every indexed directory's
+    mtime: Vite empties and rewrites dist, which touches both.
+    """
+
+    def __init__(self, roots: list[Path], interval: float = 0.5) -> None:
+        self.roots = roots
+        self.interval = interval
+        self.hits = 0
+        self.misses = 0
+        self.rescans = 0
+        self._refresh_lock = threading.Lock()
+        self._files: dict[str, FileMeta] = {}
+        self._dirs: list[str] = []
+        self._stamp: tuple = ()
+        self._checked_at = 0.0
+        self._scan()
+
+    def _scan(self) -> None:
+        files: dict[str, FileMeta] = {}
+        dirs: list[str] = []
+        for root in self.roots:
+            for dirpath, _, filenames in os.walk(root):
+                dirs.append(dirpath)
+                for name in filenames:
+                    path = os.path.join(dirpath, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    ctype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+                    files[path] = FileMeta(st.st_size, st.st_mtime_ns, ctype, make_etag(st))
+        stamp = self._compute_stamp(dirs)
+        # Swap in one assignment each so concurrent readers see old or new, never a mix.
+        self._files, self._dirs, self._stamp = files, dirs, stamp
+        self._checked_at = time.monotonic()
+
+    def _compute_stamp(self, dirs: list[str]) -> tuple:
+        stamp = []
+        for path in [os.path.join(self.roots[0], "index.html"), *dirs]:
+            try:
+                st = os.stat(path)
+            except OSError:
+                stamp.append(None)
+            else:
+                stamp.append((st.st_ino, st.st_mtime_ns, st.st_size))
+        return tuple(stamp)
+
+    def refresh(self, force: bool = False) -> bool:
+        """Rescan if the build changed; return whether a rescan happened."""
+        if not force and time.monotonic() - self._checked_at < self.interval:
+            return False
+        # One thread checks; the rest keep answering from the current index.
+        if not self._refresh_lock.acquire(blocking=force):
+            return False
+        try:
+            self._checked_at = time.monotonic()
+            if self._compute_stamp(self._dirs) == self._stamp:
+                return False
+            self._scan()
+            self.rescans += 1
+            return True
+        finally:
+            self._refresh_lock.release()
+
+    def lookup(self, path: Path) -> FileMeta | None:
+        self.refresh()
+        meta = self._files.get(str(path))
+        if meta is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return meta
+
+    def stat(self, path: Path) -> FileMeta:
+        """Drop-in for os.stat() on indexed paths."""
+        meta = self.lookup(path)
+        if meta is None:
+            raise FileNotFoundError(str(path))
+        return meta
+
+    def retarget(self, roots: list[Path]) -> None:
+        """Index a different set of directories, e.g. after a build swap."""
+        with self._refresh_lock:
+            self.roots = roots
+            self._scan()
+            self.rescans += 1
+
+    def stats(self) -> dict[str, int]:
+        return {"files": len(self._files), "hits": self.hits, "misses": self.misses, "rescans": self.rescans}
+
+
+# Pack layout: header (magic, index offset, index length), the file bytes
+# back to back, then a JSON offset table of [path, offset, size, mtime_ns].
+PACK_MAGIC = b"SPAPACK1"
+PACK_HEADER = struct.Struct("<8sQQ")
+
+
+def write_pack(root: Path, out: Path, precompress_dir: Path | None = None) -> int:
+    """Pack every file under root, plus precompressed variants, into out; return the entry count.
+
+    Variants are stored as siblings of their source (``app.js.gz``) with the
+    source mtime they were stamped with, so lookups work as on disk. A
+    variant already present in root wins over the cache directory's copy.
+    """
+    sources: dict[str, Path] = {}
+    for base in ([precompress_dir] if precompress_dir is not None and precompress_dir.is_dir() else []) + [root]:
+        for path in sorted(base.rglob("*")):
+            if path.is_file() and path.resolve() != out.resolve():
+                sources[path.relative_to(base).as_posix()] = path
+    tmp = out.with_name(f"{out.name}.{os.getpid()}.tmp")
+    table = []
+    with open(tmp, "wb") as f:
+        f.write(PACK_HEADER.pack(PACK_MAGIC, 0, 0))
+        for rel_path, path in sorted(sources.items()):
+            st = path.stat()
+            offset = f.tell()
+            with open(path, "rb") as src:
+                shutil.copyfileobj(src, f)
+            table.append([rel_path, offset, f.tell() - offset, st.st_mtime_ns])
+        index_offset = f.tell()
+        f.write(json.dumps({"files": table}, separators=(",", ":")).encode("utf-8"))
+        index_length = f.tell() - index_offset
+        f.seek(0)
+        f.write(PACK_HEADER.pack(PACK_MAGIC, index_offset, index_length))
+    # Swapped in whole, so a server reading the old pack remaps on its next check.
+    os.replace(tmp, out)
+    return len(table)
+
+
+@dataclass(frozen=True)
+class PackedFile(FileMeta):
+    """FileMeta for a packed file, carrying its bytes as a slice of the mapping."""
+
+    data: memoryview = field(repr=False, compare=False)
+
+
+class PackedBundle:
+    """A --pack archive, memory-mapped and served in place of the root directory.
+
+    Paths are keyed under the pack's own path, which stands in for the root,
+    and it quacks like FileIndex for SPASite. Each entry's bytes are a
+    memoryview slice of one mapping: lookups never touch the filesystem and
+    bodies are written without a read or copy. A replaced pack is remapped
+    on the next generation check; slices of the old mapping keep it alive
+    until the responses using them finish.
+    """
+
+    def __init__(self, path: Path, interval: float = 0.5) -> None:
+        self.path = path
+        self.interval = interval
+        self.hits = 0
+        self.misses = 0
+        self.rescans = 0
+        self._refresh_lock = threading.Lock()
+        self._files: dict[str, PackedFile] = {}
+        self._stamp: tuple = ()
+        self._checked_at = 0.0
+        self._load()
+
+    def _compute_stamp(self) -> tuple:
+        st = os.stat(self.path)
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _load(self) -> None:
+        stamp = self._compute_stamp()
+        with open(self.path, "rb") as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(mapping) < PACK_HEADER.size:
+            raise ValueError(f"{self.path} is too short to be a pack")
+        magic, index_offset, index_length = PACK_HEADER.unpack_from(mapping)
+        if magic != PACK_MAGIC:
+            raise ValueError(f"{self.path} is not a pack written by --pack")
+        table = json.loads(mapping[index_offset : index_offset + index_length])
+        view = memoryview(mapping)
+        files = {}
+        for rel_path, offset, size, mtime_ns in table["files"]:
+            ctype = mimetypes.guess_type(rel_path)[0] or "application/octet-stream"
+            etag = f'"{mtime_ns:x}-{size:x}"'
+            data = view[offset : offset + size]
+            files[str(self.path / rel_path)] = PackedFile(size, mtime_ns, ctype, etag, data)
+        self._files, self._stamp = files, stamp
+        self._checked_at = time.monotonic()
+
+    def refresh(self, force: bool = False) -> bool:
+        """Remap if the pack file was replaced; return whether it was."""
+        if not force and time.monotonic() - self._checked_at < self.interval:
+            return False
+        if not self._refresh_lock.acquire(blocking=force):
+            return False
+        try:
+            self._checked_at = time.monotonic()
+            try:
+                if self._compute_stamp() == self._stamp:
+                    return False
+                self._load()
+            except (OSError, ValueError):
+                # Mid-replace or truncated: keep serving the mapping we have.
+                return False
+            self.rescans += 1
+            return True
+        finally:
+            self._refresh_lock.release()
+
+    def lookup(self, path: Path) -> PackedFile | None:
+        self.refresh()
+        meta = self._files.get(str(path))
+        if meta is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return meta
+
+    def stat(self, path: Path) -> PackedFile:
+        meta = self.lookup(path)
+        if meta is None:
+            raise FileNotFoundError(str(path))
+        return meta
+
+    def read_bytes(self, path: Path) -> bytes:
+        return bytes(self.stat(path).data)
+
+    def stats(self) -> dict[str, int]:
+        return {"files": len(self._files), "hits": self.hits, "misses": self.misses, "rescans": self.rescans}
+
+
+class BuildSnapshots:
+    """Pins every request to one complete build and swaps builds atomically.
+
+    If the root is a symlink, each target it points at is a build: publish a
+    new directory and flip the link. Otherwise a build written over the root
+    is copied into ``store`` once it has stopped changing, and goes live in a
+    single assignment, so a half-written tree is never served. The last
+    ``keep`` builds before the current one stay available to old tabs.
+    """
+
+    def __init__(self, source: Path, store: Path, *, keep: int = 2, interval: float = 0.5) -> None:
+        self.source = source
+        self.store = store
+        self.keep = max(0, keep)
+        self.interval = interval
+        self.linked = source.is_symlink()
+        self.swaps = 0
+        self.on_change: list[Callable[[], object]] = []
+        self._lock = threading.Lock()
+        # Newest first: (build id, directory).
+        self._builds: list[tuple[str, Path]] = []
+        self._settling: tuple | None = None
+        if self.linked:
+            self._adopt(Path(os.path.realpath(source)))
+        for _ in range(10):
+            if self._builds:
+                break
+            self._snapshot(self._stamp())
+            time.sleep(0 if self._builds else interval)
+        if not self._builds:
+            raise FileNotFoundError(f"No build to snapshot in {source}")
+        threading.Thread(target=self._poll, name="spa-builds", daemon=True).start()
+
+    def current(self) -> Path:
+        if self.linked:
+            # One readlink per request picks up a flip immediately.
+            target = Path(os.path.realpath(self.source))
+            if target != self._builds[0][1]:
+                self._adopt(target)
+            return target
+        return self._builds[0][1]
+
+    def previous(self) -> list[Path]:
+        return [path for _, path in self._builds[1:]]
+
+    def roots(self) -> list[Path]:
+        return [path for _, path in self._builds]
+
+    def get(self, build: str) -> Path | None:
+        return next((path for build_name, path in self._builds if build_name == build), None)
+
+    def stats(self) -> dict[str, int]:
+        return {"swaps": self.swaps, "kept": len(self._builds)}
+
+    def _poll(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            if self.linked:
+                self.current()
+                continue
+            stamp = self._stamp()
+            if stamp is None or stamp[0] == self._builds[0][0]:
+                self._settling = None
+            elif stamp != self._settling:
+                # Changed since the last look: wait until it holds still.
+                self._settling = stamp
+            else:
+                self._settling = None
+                self._snapshot(stamp)
+
+    def _stamp(self) -> tuple | None:
+        """Build id plus every top-level directory mtime, None mid-write."""
+        try:
+            shell = (self.source / "index.html").stat()
+            dirs = [self.source, *(entry for entry in self.source.iterdir() if entry.is_dir())]
+            return (build_id(shell), *(os.stat(path).st_mtime_ns for path in dirs))
+        except OSError:
+            return None
+
+    def _snapshot(self, stamp: tuple | None) -> None:
+        if stamp is None:
+            return
+        build = stamp[0]
+        target = self.store / build
+        if not target.is_dir():
+            tmp = self.store / f".{build}.{os.getpid()}.tmp"
+            try:
+                shutil.rmtree(tmp, ignore_errors=True)
+                shutil.copytree(self.source, tmp, symlinks=True)
+                # Copies keep mtimes, so ids, ETags and .gz/.br variants still match.
+                if self._stamp() != stamp:
+                    raise OSError("build changed while copying")
+                os.replace(tmp, target)
+            except OSError:
+                # Lost a race with another worker, or the build moved on.
+                shutil.rmtree(tmp, ignore_errors=True)
+                if not target.is_dir():
+                    return
+        self._adopt(target, build)
+
+    def _adopt(self, path: Path, build: str | None = None) -> None:
+        with self._lock:
+            if self._builds and self._builds[0][1] == path:
+                return
+            builds = [(build or path.name, path), *(item for item in self._builds if item[1] != path)]
+            self._builds, evicted = builds[: self.keep + 1], builds[self.keep + 1 :]
+            if len(builds) > 1:
+                self.swaps += 1
+        if not self.linked:
+            for _, old in evicted:
+                shutil.rmtree(old, ignore_errors=True)
+        for callback in self.on_change:
+            callback()
+
+
+class AccessLog:
+    """JSON-lines access log written by a background thread.
+
+    Request threads only enqueue a dict; serialisation and I/O happen on the
+    writer thread in batches, so a slow terminal or pipe never stalls serving.
+    If the writer falls behind and the queue fills, records are dropped and
+    counted rather than making requests wait.
+    """
+
+    def __init__(
+        self,
+        stream: TextIO,
+        *,
+        sample: float = 1.0,
+        quiet: bool = False,
+        max_queue: int = 10000,
+        batch_size: int = 512,
+    ) -> None:
+        self.stream = stream
+        self.sample = sample
+        self.quiet = quiet
+        self.batch_size = batch_size
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._writer = threading.Thread(target=self._run, name="spa-access-log", daemon=True)
+        self._writer.start()
+
+    def access(self, record: dict) -> None:
+        """Queue one request record, subject to --log-sample and --quiet."""
+        if self.quiet or (self.sample < 1.0 and random.random() >= self.sample):
+            return
+        self._put(record)
+
+    def message(self, level: str, text: str) -> None:
+        """Queue a server message; these are never sampled or silenced."""
+        self._put({"level": level, "msg": text})
+
+    def _put(self, record: dict) -> None:
+        record["ts"] = time.time()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            closing = batch[-1] is None
+            lines = []
+            for record in batch:
+                if record is None:
+                    continue
+                record["ts"] = datetime.fromtimestamp(record["ts"], timezone.utc).isoformat(timespec="milliseconds")
+                lines.append(json.dumps(record, separators=(",", ":")))
+            if lines:
+                try:
+                    self.stream.write("\n".join(lines) + "\n")
+                    self.stream.flush()
+                except (OSError, ValueError):
+                    pass
+            if closing:
+                return
+
+    def close(self, timeout: float = 2.0) -> None:
+        """Flush queued records and stop the writer."""
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._writer.join(timeout)
+
+
+# Request headers that change what the server sends back; the rest are not recorded.
+TRACE_HEADERS = ("Accept", "Accept-Encoding", "Range", "If-Range", "If-None-Match", "If-Modified-Since")
+
+
+class TraceRecorder:
+    """Request trace for replay_spa_preview.py, written by a background thread.
+
+    The first line is a header with the wall-clock start; each request is
+    then one compact JSON array: milliseconds since the previous request (or
+    the start), method, request target and, when any were sent, the
+    TRACE_HEADERS. Bodies are not recorded. A path ending in .gz is written
+    gzip-compressed. Like AccessLog, a full queue drops and counts records.
+    """
+
+    def __init__(self, path: Path, *, max_queue: int = 10000, batch_size: int = 512) -> None:
+        self.path = path
+        self.batch_size = batch_size
+        self.recorded = 0
+        self.dropped = 0
+        opener = gzip.open if path.suffix == ".gz" else open
+        self._stream = opener(path, "at", encoding="utf-8")
+        self._stream.write(json.dumps({"trace": 1, "t0": time.time(), "pid": os.getpid()}) + "\n")
+        self._lock = threading.Lock()
+        self._last = time.monotonic()
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._writer = threading.Thread(target=self._run, name="spa-trace", daemon=True)
+        self._writer.start()
+
+    def request(self, method: str, target: str, headers: Message) -> None:
+        kept = {name: value for name in TRACE_HEADERS if (value := headers.get(name)) is not None}
+        with self._lock:
+            # Gaps are taken and queued under one lock so they stay in arrival order.
+            now = time.monotonic()
+            row = [round((now - self._last) * 1000, 1), method, target, *([kept] if kept else [])]
+            self._last = now
+            try:
+                self._queue.put_nowait(row)
+                self.recorded += 1
+            except queue.Full:
+                self.dropped += 1
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            closing = batch[-1] is None
+            lines = [json.dumps(row, separators=(",", ":")) for row in batch if row is not None]
+            try:
+                if lines:
+                    self._stream.write("\n".join(lines) + "\n")
+                    self._stream.flush()
+                if closing:
+                    self._stream.close()
+            except (OSError, ValueError):
+                pass
+            if closing:
+                return
+
+    def stats(self) -> dict[str, int]:
+        return {"recorded": self.recorded, "dropped": self.dropped}
+
+    def close(self, timeout: float = 2.0) -> None:
+        """Flush queued requests, close the file and stop the writer."""
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._writer.join(timeout)
+
+
+class Metrics:
+    """Request counters and latency histograms in Prometheus text format.
+
+    Served at METRICS_PATH. Stats of other components (cache, index, worker
+    pool) are registered as sources and exported alongside.
+    """
+
+    buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    phases = ("resolve", "read", "upstream", "send")
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._requests: dict[tuple[str, int], int] = {}
+        self._bytes: dict[str, int] = {}
+        self._histograms: dict[tuple[str, str], list[float]] = {}
+        self._upstream_requests: dict[tuple[str, int], int] = {}
+        self._sources: list[tuple[str, Callable[[], dict[str, float]]]] = []
+
+    def add_source(self, prefix: str, stats: Callable[[], dict[str, float]]) -> None:
+        self._sources.append((prefix, stats))
+
+    def observe(self, route: str, status: int, body_bytes: int, timings: dict[str, float], total: float) -> None:
+        with self._lock:
+            self._requests[(route, status)] = self._requests.get((route, status), 0) + 1
+            self._bytes[route] = self._bytes.get(route, 0) + body_bytes
+            self._observe(("request", route), total)
+            for phase in self.phases:
+                if phase in timings:
+                    self._observe((phase, route), timings[phase])
+
+    def observe_upstream(self, upstream: str, status: int, seconds: float) -> None:
+        """Record one proxied request: status and time to the upstream's response head."""
+        with self._lock:
+            key = (upstream, status)
+            self._upstream_requests[key] = self._upstream_requests.get(key, 0) + 1
+            self._observe(("upstream_latency", upstream), seconds)
+
+    def _observe(self, key: tuple[str, str], value: float) -> None:
+        # Layout: one count per bucket, then +Inf count, then sum.
+        hist = self._histograms.get(key)
+        if hist is None:
+            hist = self._histograms[key] = [0.0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                hist[i] += 1
+        hist[-2] += 1
+        hist[-1] += value
+
+    def render(self) -> str:
+        lines = [
+            "# HELP spa_preview_requests_total Requests answered, by route class and status.",
+            "# TYPE spa_preview_requests_total counter",
+        ]
+        with self._lock:
+            for (route, status), count in sorted(self._requests.items()):
+                lines.append(f'spa_preview_requests_total{{route="{route}",status="{status}"}} {count}')
+            lines += [
+                "# HELP spa_preview_response_bytes_total Body bytes sent, by route class.",
+                "# TYPE spa_preview_response_bytes_total counter",
+            ]
+            for route, count in sorted(self._bytes.items()):
+                lines.append(f'spa_preview_response_bytes_total{{route="{route}"}} {count}')
+            lines += [
+                "# HELP spa_preview_request_duration_seconds Time from parsed request to last body byte.",
+                "# TYPE spa_preview_request_duration_seconds histogram",
+            ]
+            lines += self._render_histograms("spa_preview_request_duration_seconds", "request", "")
+            lines += [
+                "# HELP spa_preview_phase_duration_seconds Time spent resolving, reading and sending.",
+                "# TYPE spa_preview_phase_duration_seconds histogram",
+            ]
+            for phase in self.phases:
+                lines += self._render_histograms("spa_preview_phase_duration_seconds", phase, f'phase="{phase}",')
+            if self._upstream_requests:
+                lines += [
+                    "# HELP spa_preview_upstream_requests_total Proxied requests, by upstream and status.",
+                    "# TYPE spa_preview_upstream_requests_total counter",
+                ]
+                for (upstream, status), count in sorted(self._upstream_requests.items()):
+                    lines.append(f'spa_preview_upstream_requests_total{{upstream="{upstream}",status="{status}"}} {count}')
+                lines += [
+                    "# HELP spa_preview_upstream_duration_seconds Time until an upstream's response head arrived.",
+                    "# TYPE spa_preview_upstream_duration_seconds histogram",
+                ]
+                lines += self._render_histograms(
+                    "spa_preview_upstream_duration_seconds", "upstream_latency", "", label="upstream"
+                )
+        for prefix, stats in self._sources:
+            values = stats()
+            for key, value in values.items():
+                lines.append(f"spa_preview_{prefix}_{key} {value}")
+            lookups = values.get("hits", 0) + values.get("misses", 0)
+            if "hits" in values and lookups:
+                lines.append(f"spa_preview_{prefix}_hit_ratio {values['hits'] / lookups:.6f}")
+        return "\n".join(lines) + "\n"
+
+    def _render_histograms(self, name: str, kind: str, extra_label: str, label: str = "route") -> list[str]:
+        lines = []
+        for (hist_kind, route), hist in sorted(self._histograms.items()):
+            if hist_kind != kind:
+                continue
+            labels = f'{extra_label}{label}="{route}"'
+            for bound, count in zip(self.buckets, hist):
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {int(count)}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {int(hist[-2])}')
+            lines.append(f"{name}_sum{{{labels}}} {hist[-1]:.6f}")
+            lines.append(f"{name}_count{{{labels}}} {int(hist[-2])}")
+        return lines
+
+
+# Where Vite writes build.manifest: 5.x uses .vite/, 4.x the dist root.
+VITE_MANIFESTS = (".vite/manifest.json", "manifest.json")
+
+
+class _ShellAssetParser(HTMLParser):
+    """Collects the module scripts and stylesheets index.html loads up front."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.links: list[tuple[str, str, bool]] = []
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        attr = dict(attrs)
+        crossorigin = "crossorigin" in attr
+        if tag == "script" and attr.get("type") == "module" and attr.get("src"):
+            self.links.append((attr["src"], "modulepreload", crossorigin))
+        elif tag == "link" and attr.get("href"):
+            rel = (attr.get("rel") or "").lower().split()
+            if "stylesheet" in rel:
+                self.links.append((attr["href"], "style", crossorigin))
+            elif "modulepreload" in rel:
+                self.links.append((attr["href"], "modulepreload", crossorigin))
+
+
+class PreloadHints:
+    """Link preload header for the SPA shell, derived once per build.
+
+    Follows the static import graph of the entries in Vite's build manifest
+    (build.manifest); without one, the module scripts, stylesheets and
+    modulepreload links in index.html are used. The result is cached per
+    build directory against index.html's mtime, which every build rewrites.
+    """
+
+    max_builds = 8
+
+    def __init__(self, read: Callable[[Path], bytes] = Path.read_bytes) -> None:
+        self._read = read
+        self._lock = threading.Lock()
+        self._values: dict[tuple[Path, int], str] = {}
+
+    def link_header(self, root: Path, shell_mtime_ns: int) -> str:
+        key = (root, shell_mtime_ns)
+        value = self._values.get(key)
+        if value is None:
+            with self._lock:
+                value = self._values.get(key)
+                if value is None:
+                    if len(self._values) >= self.max_builds:
+                        self._values.clear()
+                    value = self._values[key] = self._build(root)
+        return value
+
+    def _build(self, root: Path) -> str:
+        try:
+            shell = self._read(root / "index.html").decode("utf-8", errors="replace")
+        except OSError:
+            return ""
+        links = self._from_manifest(root, shell)
+        if links is None:
+            parser = _ShellAssetParser()
+            parser.feed(shell)
+            links = [
+                (urljoin("/", href), kind, crossorigin)
+                for href, kind, crossorigin in parser.links
+                if not urlsplit(href).scheme and not href.startswith("//")
+            ]
+        seen: set[str] = set()
+        values = []
+        for url, kind, crossorigin in links:
+            if url in seen:
+                continue
+            seen.add(url)
+            value = f"<{url}>; rel=modulepreload" if kind == "modulepreload" else f"<{url}>; rel=preload; as=style"
+            values.append(value + "; crossorigin" if crossorigin else value)
+        return ", ".join(values)
+
+    def _from_manifest(self, root: Path, shell: str) -> list[tuple[str, str, bool]] | None:
+        for name in VITE_MANIFESTS:
+            try:
+                manifest = json.loads(self._read(root / name))
+            except (OSError, ValueError):
+                continue
+            if isinstance(manifest, dict):
+                break
+        else:
+            return None
+
+        manifest = {key: chunk for key, chunk in manifest.items() if isinstance(chunk, dict)}
+        entries = [key for key, chunk in manifest.items() if chunk.get("isEntry")]
+        # Prefer the chunks index.html itself loads over other build inputs.
+        shell_entries = [key for key in entries if key.endswith(".html") or manifest[key].get("file", "") in shell]
+        styles: list[str] = []
+        modules: list[str] = []
+        visited: set[str] = set()
+
+        def visit(key: str) -> None:
+            if key in visited or key not in manifest:
+                return
+            visited.add(key)
+            chunk = manifest[key]
+            styles.extend(chunk.get("css", ()))
+            if chunk.get("file", "").endswith((".js", ".mjs")):
+                modules.append(chunk["file"])
+            for imported in chunk.get("imports", ()):
+                visit(imported)
+
+        for key in shell_entries or entries:
+            visit(key)
+        # Vite emits crossorigin on the shell's script and stylesheet tags; the
+        # preloads must match or the browser fetches everything twice.
+        base = self._base_url(shell, modules + styles)
+        return [(base + path, "style", True) for path in styles] + [
+            (base + path, "modulepreload", True) for path in modules
+        ]
+
+    @staticmethod
+    def _base_url(shell: str, files: list[str]) -> str:
+        # Recover Vite's `base` from how index.html spells an emitted file.
+        for path in files:
+            match = re.search(r"""["']([^"'\s]*)""" + re.escape(path) + """["']""", shell)
+            if match:
+                return urljoin("/", match.group(1))
+        return "/"
+
+
+# Module code that resolves anything against its own URL would resolve
+# against the page once inlined: relative imports, import.meta.
+RELATIVE_IMPORT_RE = re.compile(r"""(?:\bfrom|\bimport)\s*\(?\s*["'`]\.{1,2}/|\bimport\.meta\b""")
+CSS_URL_RE = re.compile(r"""url\(\s*(["']?)([^"')]*)\1\s*\)|@import\s+(["'])([^"']*)\3""")
+
+
+class _InlineCandidateParser(HTMLParser):
+    """Finds the stylesheet links and external scripts in index.html, with their spans."""
+
+    def __init__(self, text: str) -> None:
+        super().__init__(convert_charrefs=False)
+        self.candidates: list[tuple[int, int, str, str, dict[str, str | None]]] = []
+        self._line_starts = [0]
+        self._line_starts.extend(match.end() for match in re.finditer("\n", text))
+        self._text = text
+        self._script: tuple[int, str, dict[str, str | None]] | None = None
+
+    def _offset(self) -> int:
+        line, column = self.getpos()
+        return self._line_starts[line - 1] + column
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        attr = dict(attrs)
+        start = self._offset()
+        if tag == "link" and attr.get("href") and "stylesheet" in (attr.get("rel") or "").lower().split():
+            end = start + len(self.get_starttag_text())
+            self.candidates.append((start, end, "style", attr["href"], attr))
+        elif tag == "script" and attr.get("src"):
+            self._script = (start, attr["src"], attr)
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == "script" and self._script is not None:
+            start, src, attr = self._script
+            end = self._text.find(">", self._offset()) + 1
+            self.candidates.append((start, end, "script", src, attr))
+            self._script = None
+
+
+@dataclass(frozen=True)
+class InlinedShell:
+    """index.html with its small stylesheets and scripts inlined."""
+
+    data: bytes
+    # Compressed copies of data by content coding, made once per build.
+    encoded: dict[str, bytes]
+    # URLs now carried in the document; preloading them would fetch them twice.
+    inlined: frozenset[str]
+
+
+class ShellInliner:
+    """Builds and keeps the inlined SPA shell, once per build generation.
+
+    Stylesheets and external scripts index.html loads up front are inlined
+    when they are at most ``max_bytes``. Relative url()/@import references in
+    inlined CSS are rewritten against the stylesheet's URL; scripts with
+    relative imports or import.meta, deferred or async classic scripts,
+    ``integrity`` and anything that cannot sit inside a <style>/<script>
+    element are left linked. A generation is index.html plus every candidate
+    file, so a rebuild or an edited stylesheet produces a new shell.
+    """
+
+    max_builds = 8
+
+    def __init__(self, max_bytes: int, read: Callable[[Path], bytes] = Path.read_bytes) -> None:
+        self.max_bytes = max_bytes
+        self._read = read
+        self._lock = threading.Lock()
+        self._shells: dict[Path, tuple[tuple, InlinedShell]] = {}
+        self._builds = 0
+        self._hits = 0
+
+    def shell(self, root: Path, stat: Callable[[Path], os.stat_result | FileMeta]) -> InlinedShell:
+        cached = self._shells.get(root)
+        if cached is not None and self._generation(cached[0], stat) == cached[0]:
+            self._hits += 1
+            return cached[1]
+        with self._lock:
+            cached = self._shells.get(root)
+            if cached is not None and self._generation(cached[0], stat) == cached[0]:
+                self._hits += 1
+                return cached[1]
+            # Stamp before reading so a write racing the build forces a rebuild.
+            shell_path = root / "index.html"
+            stamps = [self._stamp(shell_path, stat)]
+            text = self._read(shell_path).decode("utf-8", errors="replace")
+            parser = _InlineCandidateParser(text)
+            parser.feed(text)
+            parser.close()
+            paths = [self._local_path(root, url) for _, _, _, url, _ in parser.candidates]
+            stamps.extend(self._stamp(path, stat) if path is not None else None for path in paths)
+            generation = tuple(stamps)
+            shell = self._build(text, parser.candidates, paths)
+            if root not in self._shells and len(self._shells) >= self.max_builds:
+                self._shells.clear()
+            self._shells[root] = (generation, shell)
+            self._builds += 1
+            return shell
+
+    def stats(self) -> dict[str, int]:
+        return {"builds": self._builds, "hits": self._hits}
+
+    def _generation(self, previous: tuple, stat: Callable[[Path], os.stat_result | FileMeta]) -> tuple:
+        # index.html's stamp covers any change to which files the shell names.
+        return tuple(self._stamp(stamp[0], stat) if stamp is not None else None for stamp in previous)
+
+    @staticmethod
+    def _stamp(path: Path, stat: Callable[[Path], os.stat_result | FileMeta]) -> tuple | None:
+        try:
+            st = stat(path)
+        except OSError:
+            return (path, None)
+        return (path, st.st_mtime_ns, st.st_size)
+
+    @staticmethod
+    def _local_path(root: Path, url: str) -> Path | None:
+        parts = urlsplit(url)
+        if parts.scheme or parts.netloc:
+            return None
+        path = posixpath.normpath("/" + unquote(urljoin("/", parts.path))).lstrip("/")
+        return root / path if path not in ("", ".") else None
+
+    def _build(self, text: str, candidates: list, paths: list[Path | None]) -> InlinedShell:
+        pieces = []
+        inlined = set()
+        cursor = 0
+        for (start, end, kind, url, attr), path in zip(candidates, paths):
+            element = self._inline(kind, urljoin("/", url), attr, path) if path is not None else None
+            if element is None:
+                continue
+            pieces.append(text[cursor:start])
+            pieces.append(element)
+            cursor = end
+            inlined.add(urljoin("/", url))
+        pieces.append(text[cursor:])
+        data = "".join(pieces).encode("utf-8")
+        codecs = [("gzip", lambda raw: gzip.compress(raw, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            codecs.append(("br", lambda raw: brotli.compress(raw, quality=11)))
+        encoded = {coding: packed for coding, compress in codecs if len(packed := compress(data)) < len(data)}
+        return InlinedShell(data, encoded, frozenset(inlined))
+
+    def _inline(self, kind: str, url: str, attr: dict[str, str | None], path: Path) -> str | None:
+        if "integrity" in attr:
+            return None
+        try:
+            raw = self._read(path)
+        except OSError:
+            return None
+        if len(raw) > self.max_bytes:
+            return None
+        try:
+            source = raw.decode("utf-8")
+        except UnicodeDecodeError:
+            return None
+        if kind == "style":
+            if "</style" in source.lower() or set(attr) - {"rel", "href", "crossorigin", "media", "type"}:
+                return None
+            media = f' media="{html.escape(attr["media"])}"' if attr.get("media") else ""
+            return f"<style{media}>{self._rebase_css(source, url)}</style>"
+        module = attr.get("type") == "module"
+        if "</script" in source.lower() or "<!--" in source:
+            return None
+        if module and RELATIVE_IMPORT_RE.search(source):
+            return None
+        if not module and ("defer" in attr or "async" in attr):
+            # Inline classic scripts run immediately, which would reorder them.
+            return None
+        kept = "".join(
+            f" {name}" if value is None else f' {name}="{html.escape(value)}"'
+            for name, value in attr.items()
+            if name not in ("src", "crossorigin")
+        )
+        return f"<script{kept}>{source}</script>"
+
+    @staticmethod
+    def _rebase_css(css: str, url: str) -> str:
+        def rebase(match: re.Match) -> str:
+            if match.group(2) is not None:
+                quote, ref = match.group(1), match.group(2).strip()
+                template = "url({q}{ref}{q})"
+            else:
+                quote, ref = match.group(3), match.group(4)
+                template = "@import {q}{ref}{q}"
+            if not ref or ref.startswith(("#", "/", "data:")) or urlsplit(ref).scheme:
+                return match.group(0)
+            return template.format(q=quote, ref=urljoin(url, ref))
+
+        return CSS_URL_RE.sub(rebase, css)
+
+
+class HashedFiles:
+    """Which files of a build are content-hashed, per Vite's build manifest.
+
+    The manifest lists every file the bundler named by hash (chunks, CSS and
+    imported assets); anything else, such as public/ files copied under
+    assets/, keeps revalidating. Without a manifest the filename check of
+    is_fingerprinted() decides. Cached per build directory against
+    index.html's mtime, which every build rewrites.
+    """
+
+    max_builds = 8
+
+    def __init__(self, read: Callable[[Path], bytes] = Path.read_bytes) -> None:
+        self._read = read
+        self._lock = threading.Lock()
+        self._files: dict[Path, tuple[int | None, frozenset[str] | None]] = {}
+
+    def contains(self, root: Path, rel_path: str, stat: Callable[[Path], os.stat_result | FileMeta]) -> bool:
+        try:
+            stamp = stat(root / "index.html").st_mtime_ns
+        except OSError:
+            stamp = None
+        cached = self._files.get(root)
+        if cached is None or cached[0] != stamp:
+            with self._lock:
+                cached = self._files.get(root)
+                if cached is None or cached[0] != stamp:
+                    if root not in self._files and len(self._files) >= self.max_builds:
+                        self._files.clear()
+                    cached = self._files[root] = (stamp, self._load(root))
+        files = cached[1]
+        return is_fingerprinted(rel_path) if files is None else rel_path in files
+
+    def _load(self, root: Path) -> frozenset[str] | None:
+        for name in VITE_MANIFESTS:
+            try:
+                manifest = json.loads(self._read(root / name))
+            except (OSError, ValueError):
+                continue
+            if isinstance(manifest, dict):
+                break
+        else:
+            return None
+        files = set()
+        for chunk in manifest.values():
+            if not isinstance(chunk, dict):
+                continue
+            for key in ("file", "css", "assets"):
+                value = chunk.get(key, ())
+                files.update([value] if isinstance(value, str) else value)
+        return frozenset(files)
+
+
+LIVE_RELOAD_PATH = "/__livereload"
+# Comment frames this often let a stream notice tabs that went away.
+LIVE_RELOAD_HEARTBEAT = 15.0
+LIVE_RELOAD_SNIPPET = (
+    '<script type="module">const b=%s,s=new EventSource(%s);'
+    's.addEventListener("build",e=>{if(e.data!==b){s.close();location.reload()}})</script>'
+)
+EVENT_STREAM_HEADERS = (
+    ("Content-Type", "text/event-stream; charset=utf-8"),
+    ("Cache-Control", "no-store"),
+    ("X-Accel-Buffering", "no"),
+)
+
+# inotify(7) bits: anything written, moved or removed in a watched directory.
+IN_WATCH_MASK = 0x8 | 0x40 | 0x80 | 0x100 | 0x200 | 0x400 | 0x800
+IN_NONBLOCK_CLOEXEC = os.O_NONBLOCK | getattr(os, "O_CLOEXEC", 0)
+try:
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _inotify_init1 = _libc.inotify_init1
+    _inotify_add_watch = _libc.inotify_add_watch
+    _inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+except (OSError, AttributeError, TypeError):  # Not Linux: LiveReload polls instead.
+    _inotify_init1 = _inotify_add_watch = None
+
+
+def build_id(st: os.stat_result | FileMeta) -> str:
+    """Identify a build by its index.html, which every build rewrites."""
+    return make_etag(st).strip('"')
+
+
+class LiveReload:
+    """Tells open tabs about new builds over Server-Sent Events.
+
+    A watcher thread notices rebuilds through inotify on the root and its
+    top-level directories (stat polling where inotify is unavailable) and
+    publishes a new build id. Announcing a change costs the same whatever
+    the number of open streams: threads wait on one Event that is swapped
+    per change, and each event loop on one future. ``current_root`` names
+    the directory whose index.html defines the live build, when that is not
+    the watched root itself (--snapshots).
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        *,
+        interval: float = 0.5,
+        debounce: float = 0.2,
+        current_root: Callable[[], Path] | None = None,
+    ) -> None:
+        self.root = root
+        self.current_root = current_root or (lambda: root)
+        self.interval = interval
+        self.debounce = debounce
+        self.builds = 0
+        self.on_change: list[Callable[[], object]] = []
+        self.build = self._current_build()
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+        self._loop_waiters: dict[asyncio.AbstractEventLoop, asyncio.Future] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._watch, name="spa-livereload", daemon=True)
+        self._thread.start()
+
+    def snippet(self, build: str) -> bytes:
+        return (LIVE_RELOAD_SNIPPET % (json.dumps(build), json.dumps(LIVE_RELOAD_PATH))).encode("utf-8")
+
+    def inject(self, shell: bytes, build: str) -> bytes:
+        at = shell.lower().rfind(b"</body>")
+        if at < 0:
+            return shell + self.snippet(build)
+        return shell[:at] + self.snippet(build) + shell[at:]
+
+    @staticmethod
+    def event(build: str) -> bytes:
+        return f"event: build\ndata: {build}\n\n".encode("utf-8")
+
+    def wait(self, known: str | None, timeout: float) -> str:
+        """Block until the build differs from ``known`` or timeout; return it."""
+        with self._lock:
+            if self.build != known:
+                return self.build
+            changed = self._changed
+        changed.wait(timeout)
+        return self.build
+
+    async def wait_async(self, known: str | None, timeout: float) -> str:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self.build != known:
+                return self.build
+            waiter = self._loop_waiters.get(loop)
+            if waiter is None:
+                waiter = self._loop_waiters[loop] = loop.create_future()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.build
+
+    def stats(self) -> dict[str, int]:
+        return {"builds": self.builds, "inotify": int(_inotify_init1 is not None)}
+
+    def close(self) -> None:
+        self._stop.set()
+
+    def _current_build(self) -> str | None:
+        try:
+            return build_id((self.current_root() / "index.html").stat())
+        except OSError:
+            return None
+
+    def check(self) -> None:
+        """Publish the live build if it changed."""
+        build = self._current_build()
+        if build is None or build == self.build:
+            return
+        for callback in self.on_change:
+            callback()
+        with self._lock:
+            self.build = build
+            self.builds += 1
+            changed, self._changed = self._changed, threading.Event()
+            waiters, self._loop_waiters = self._loop_waiters, {}
+        changed.set()
+        for loop, waiter in waiters.items():
+            try:
+                loop.call_soon_threadsafe(_resolve_waiter, waiter)
+            except RuntimeError:  # That loop has shut down.
+                pass
+
+    def _watch(self) -> None:
+        fd = _inotify_init1(IN_NONBLOCK_CLOEXEC) if _inotify_init1 is not None else -1
+        try:
+            while not self._stop.is_set():
+                if fd < 0:
+                    self._stop.wait(self.interval)
+                else:
+                    self._add_watches(fd)
+                    # The timeout doubles as a safety net for missed events.
+                    if select.select([fd], [], [], 2.0)[0]:
+                        # Let the build finish writing before looking at it.
+                        while self._drain(fd):
+                            time.sleep(self.debounce)
+                self.check()
+        finally:
+            if fd >= 0:
+                os.close(fd)
+
+    def _add_watches(self, fd: int) -> None:
+        # Repeated adds are no-ops; this also follows a replaced root or assets dir.
+        try:
+            directories = [self.root, *(entry for entry in self.root.iterdir() if entry.is_dir())]
+        except OSError:
+            return
+        for directory in directories:
+            _inotify_add_watch(fd, os.fsencode(directory), IN_WATCH_MASK)
+
+    @staticmethod
+    def _drain(fd: int) -> bool:
+        drained = False
+        while True:
+            try:
+                if not os.read(fd, 65536):
+                    return drained
+            except BlockingIOError:
+                return drained
+            drained = True
+
+
+def _resolve_waiter(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+# Headers that describe one connection, not the message (RFC 9110 section 7.6.1).
+HOP_BY_HOP_HEADERS = frozenset(
+    {"connection", "keep-alive", "proxy-connection", "te", "trailer", "transfer-encoding", "upgrade"}
+)
+PROXY_CHUNK_BYTES = 64 * 1024
+# Proxied request bodies are buffered before forwarding; cap their size.
+MAX_PROXY_BODY = 64 * 1024 * 1024
+# A body sent with GET/HEAD is read and dropped to keep a persistent
+# connection in step; larger ones end the connection instead.
+MAX_DISCARDED_BODY = 1024 * 1024
+
+
+def parse_proxy_rule(spec: str) -> tuple[str, str]:
+    """argparse type for --proxy PREFIX=URL."""
+    prefix, sep, url = spec.partition("=")
+    if not sep or not prefix.startswith("/") or urlsplit(url).scheme not in ("http", "https"):
+        raise argparse.ArgumentTypeError(f"expected /prefix=http://host:port, got {spec!r}")
+    return prefix.rstrip("/"), url.rstrip("/")
+
+
+def check_request_body(headers: Message) -> tuple[int, str] | None:
+    """Status and reason for a request body the proxy will not forward."""
+    if "Transfer-Encoding" in headers:
+        return 411, "Chunked request bodies are not supported; send Content-Length"
+    length = headers.get("Content-Length", "0").strip()
+    if not length.isdigit():
+        return 400, f"Bad Content-Length ({length!r})"
+    if int(length) > MAX_PROXY_BODY:
+        return 413, "Request body too large"
+    return None
+
+
+def _forwardable(headers: Message | http.client.HTTPMessage) -> list[tuple[str, str]]:
+    hop_by_hop = set(HOP_BY_HOP_HEADERS)
+    for value in headers.get_all("Connection") or ():
+        hop_by_hop.update(token.strip().lower() for token in value.split(","))
+    return [(name, value) for name, value in headers.items() if name.lower() not in hop_by_hop]
+
+
+class Upstream:
+    """One proxied backend with a bounded pool of keep-alive connections."""
+
+    def __init__(self, prefix: str, url: str, *, pool_size: int = 8, timeout: float = 30.0) -> None:
+        parts = urlsplit(url)
+        self.prefix = prefix
+        self.url = url
+        self.base_path = parts.path
+        self.timeout = timeout
+        self.pool_size = max(1, pool_size)
+        connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self._connect = lambda: connection_class(parts.hostname, parts.port, timeout=timeout)
+        self._lock = threading.Lock()
+        self._idle: list[http.client.HTTPConnection] = []
+        self._slots = threading.BoundedSemaphore(self.pool_size)
+        self.opened = 0
+        self.reused = 0
+        self.failed = 0
+
+    def matches(self, path: str) -> bool:
+        return path == self.prefix or path.startswith(self.prefix + "/")
+
+    def open(
+        self, method: str, target: str, headers: list[tuple[str, str]], body: bytes | None
+    ) -> tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+        """Send a request and return its connection and response head.
+
+        The connection counts against the pool until release() is called.
+        """
+        # http.client takes a mapping; repeated fields fold into one (RFC 9110 section 5.3).
+        fields: dict[str, str] = {}
+        for name, value in headers:
+            fields[name] = f"{fields[name]}, {value}" if name in fields else value
+        if not self._slots.acquire(timeout=self.timeout):
+            self.failed += 1
+            raise TimeoutError(f"no free connection to {self.url}")
+        try:
+            while True:
+                conn, reused = self._checkout()
+                try:
+                    conn.request(method, self.base_path + target, body=body, headers=fields)
+                    return conn, conn.getresponse()
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    # A pooled connection may have been closed by the backend
+                    # while idle; only a fresh connection failing is an error.
+                    if not reused:
+                        raise
+        except BaseException:
+            self.failed += 1
+            self._slots.release()
+            raise
+
+    def release(self, conn: http.client.HTTPConnection, reusable: bool) -> None:
+        if reusable:
+            with self._lock:
+                self._idle.append(conn)
+        else:
+            conn.close()
+        self._slots.release()
+
+    def _checkout(self) -> tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            if self._idle:
+                self.reused += 1
+                return self._idle.pop(), True
+            self.opened += 1
+        return self._connect(), False
+
+
+class UpstreamBody:
+    """Iterates an upstream response body in chunks, then returns the connection."""
+
+    def __init__(self, upstream: Upstream, conn: http.client.HTTPConnection, resp: http.client.HTTPResponse) -> None:
+        self.upstream = upstream
+        self.resp = resp
+        self._conn: http.client.HTTPConnection | None = conn
+        self._complete = False
+
+    def __iter__(self) -> UpstreamBody:
+        return self
+
+    def __next__(self) -> bytes:
+        try:
+            chunk = self.resp.read1(PROXY_CHUNK_BYTES)
+        except (OSError, http.client.HTTPException) as exc:
+            self.close()
+            raise ConnectionAbortedError(f"upstream {self.upstream.url} failed mid-body: {exc}") from exc
+        if not chunk:
+            # read1() leaves a Content-Length response open at its end, and
+            # http.client will not send on a connection until it is closed.
+            self.resp.close()
+            self._complete = True
+            self.close()
+            raise StopIteration
+        return chunk
+
+    def close(self) -> None:
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self.upstream.release(conn, self._complete and not self.resp.will_close)
+
+
+class ReverseProxy:
+    """Forwards --proxy path prefixes to local backends, longest prefix first.
+
+    Paths are forwarded unchanged (after the upstream URL's own path) with
+    the client's Host header, like Vite's dev-server proxy. Bodies stream
+    back chunk by chunk; the time to the upstream response head is recorded
+    per upstream.
+    """
+
+    def __init__(
+        self,
+        rules: list[tuple[str, str]],
+        *,
+        pool_size: int = 8,
+        timeout: float = 30.0,
+        metrics: Metrics | None = None,
+    ) -> None:
+        upstreams = [Upstream(prefix, url, pool_size=pool_size, timeout=timeout) for prefix, url in rules]
+        self.upstreams = sorted(upstreams, key=lambda upstream: len(upstream.prefix), reverse=True)
+        self.metrics = metrics
+
+    def match(self, request_path: str) -> Upstream | None:
+        path = urlsplit(request_path).path
+        return next((upstream for upstream in self.upstreams if upstream.matches(path)), None)
 
-    def _sanitize_path(self, request_path: str) -> Path:
+    def forward(
+        self,
+        upstream: Upstream,
+        method: str,
+        request_path: str,
+        request_headers: Message,
+        body: bytes | None,
+    ) -> Response:
+        started = time.perf_counter()
+        try:
+            conn, resp = upstream.open(method, request_path, _forwardable(request_headers), body)
+        except TimeoutError as exc:
+            return self._failed(upstream, 504, f"Gateway timeout: {exc}", started)
+        except (OSError, http.client.HTTPException) as exc:
+            return self._failed(upstream, 502, f"Bad gateway: {exc}", started)
+        elapsed = time.perf_counter() - started
+        if self.metrics is not None:
+            self.metrics.observe_upstream(upstream.url, resp.status, elapsed)
+
+        # The engine writes its own Server and Date.
+        headers = [(name, value) for name, value in _forwardable(resp.msg) if name.lower() not in ("server", "date")]
+        response = Response(resp.status, headers, route="proxy", timings={"upstream": elapsed})
+        if method == "HEAD" or resp.status in (204, 304) or resp.status < 200:
+            resp.read()
+            upstream.release(conn, not resp.will_close)
+        else:
+            response.stream = UpstreamBody(upstream, conn, resp)
+        return response
+
+    def _failed(self, upstream: Upstream, status: int, message: str, started: float) -> Response:
+        if self.metrics is not None:
+            self.metrics.observe_upstream(upstream.url, status, time.perf_counter() - started)
+        return Response(status, error=message, route="proxy")
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "connections_opened": sum(upstream.opened for upstream in self.upstreams),
+            "connections_reused": sum(upstream.reused for upstream in self.upstreams),
+            "failures": sum(upstream.failed for upstream in self.upstreams),
+        }
+
+
+@dataclass(frozen=True)
+class NetworkProfile:
+    """An emulated client link: downstream bandwidth and round-trip time."""
+
+    name: str
+    kbps: float
+    rtt_ms: float
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.kbps * 1000 / 8
+
+    @property
+    def latency(self) -> float:
+        return self.rtt_ms / 1000
+
+    @property
+    def chunk_bytes(self) -> int:
+        # About twenty writes a second: smooth pacing without a syscall per packet.
+        return max(1024, min(64 * 1024, int(self.bytes_per_second / 20)))
+
+
+# The Chrome DevTools presets (as DevTools applies them) and Lighthouse's mobile link.
+NETWORK_PROFILES = {
+    "slow-3g": NetworkProfile("slow-3g", 400, 2000),
+    "fast-3g": NetworkProfile("fast-3g", 1440, 562.5),
+    "slow-4g": NetworkProfile("slow-4g", 1638.4, 150),
+}
+THROTTLE_ROUTES = ("asset", "fallback", "not_found", "proxy", "internal")
+
+
+def parse_profile(spec: str) -> tuple[str | None, NetworkProfile]:
+    """argparse type for --profile [ROUTE=]NAME, where NAME may be custom:KBPS,RTT_MS."""
+    route, sep, name = spec.partition("=")
+    if not sep:
+        route, name = None, spec
+    elif route not in THROTTLE_ROUTES:
+        raise argparse.ArgumentTypeError(f"unknown route class {route!r}; choose from {', '.join(THROTTLE_ROUTES)}")
+    if name.startswith("custom:"):
+        try:
+            kbps, rtt_ms = (float(part) for part in name[len("custom:") :].split(","))
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"expected custom:KBPS,RTT_MS, got {name!r}") from None
+        if kbps <= 0 or rtt_ms < 0:
+            raise argparse.ArgumentTypeError(f"custom profile needs KBPS > 0 and RTT_MS >= 0, got {name!r}")
+        return route, NetworkProfile(name, kbps, rtt_ms)
+    if name not in NETWORK_PROFILES:
+        choices = ", ".join([*NETWORK_PROFILES, "custom:KBPS,RTT_MS"])
+        raise argparse.ArgumentTypeError(f"unknown profile {name!r}; choose from {choices}")
+    return route, NETWORK_PROFILES[name]
+
+
+class TokenBucket:
+    """Paces bytes to a profile's bandwidth, allowing one write's worth of burst."""
+
+    def __init__(self, profile: NetworkProfile) -> None:
+        self.rate = profile.bytes_per_second
+        self.burst = float(profile.chunk_bytes)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def take(self, nbytes: int) -> float:
+        """Spend nbytes of budget; return seconds to wait before sending them."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate) - nbytes
+        self.updated = now
+        return max(0.0, -self.tokens / self.rate)
+
+
+class Throttle:
+    """Shapes one connection's responses to the profile of each route class.
+
+    Buckets live as long as the connection, so keep-alive requests share
+    bandwidth the way they would share a real link; each response also waits
+    one round trip before its first byte. Not thread-safe: a connection is
+    written by one thread or task at a time.
+    """
+
+    def __init__(self) -> None:
+        self.profile: NetworkProfile | None = None
+        self._buckets: dict[NetworkProfile, TokenBucket] = {}
+
+    def use(self, profile: NetworkProfile | None) -> float:
+        """Shape the next response with profile; return its first-byte delay."""
+        self.profile = profile
+        if profile is None:
+            return 0.0
+        if profile not in self._buckets:
+            self._buckets[profile] = TokenBucket(profile)
+        return profile.latency
+
+    def pieces(self, data: bytes | memoryview) -> Iterator[tuple[float, bytes | memoryview]]:
+        """Split data into (delay, piece) writes paced to the current profile."""
+        if self.profile is None:
+            yield 0.0, data
+            return
+        bucket = self._buckets[self.profile]
+        step = self.profile.chunk_bytes
+        for start in range(0, len(data), step):
+            piece = data[start : start + step]
+            yield bucket.take(len(piece)), piece
+
+    def spans(self, offset: int, count: int) -> Iterator[tuple[float, int, int]]:
+        """Split a sendfile span into (delay, offset, count) paced pieces."""
+        if self.profile is None:
+            yield 0.0, offset, count
+            return
+        bucket = self._buckets[self.profile]
+        step = self.profile.chunk_bytes
+        for start in range(offset, offset + count, step):
+            size = min(step, offset + count - start)
+            yield bucket.take(size), start, size
+
+
+DROP_REASONS = ("idle", "header", "write", "slow")
+# Bodies are written in slices this size so write timeouts mean "no
+# progress" rather than "not finished", and the rate can be checked.
+WRITE_SLICE = 1024 * 1024
+# A body must have been flowing this long before --min-rate applies.
+MIN_RATE_GRACE = 5.0
+# How long a normal close may take to flush what is still buffered.
+CLOSE_TIMEOUT = 5.0
+
+
+class ConnectionLimits:
+    """Deadlines that keep stalled or trickling clients from pinning a thread or task.
+
+    ``header_timeout`` bounds receiving a whole request head (and any proxied
+    request body), however slowly it trickles in. ``idle_timeout`` bounds the
+    wait for the next request on a kept-alive connection. ``write_timeout``
+    bounds a write that makes no progress, and ``min_rate`` (bytes/s, 0
+    disables) drops a client reading a body more slowly once MIN_RATE_GRACE
+    seconds have passed. ``dropped`` counts closed connections per reason.
+    """
+
+    def __init__(
+        self,
+        *,
+        header_timeout: float = 10.0,
+        idle_timeout: float = 5.0,
+        write_timeout: float = 30.0,
+        min_rate: float = 0.0,
+    ) -> None:
+        self.header_timeout = header_timeout
+        self.idle_timeout = idle_timeout
+        self.write_timeout = write_timeout
+        self.min_rate = min_rate
+        self.dropped = dict.fromkeys(DROP_REASONS, 0)
+
+    @property
+    def slice_bytes(self) -> int:
+        """Write slice size: about a second's worth at --min-rate, so slow readers are caught promptly."""
+        if not self.min_rate:
+            return WRITE_SLICE
+        return int(min(WRITE_SLICE, max(16 * 1024, self.min_rate)))
+
+    def drop(self, reason: str) -> None:
+        self.dropped[reason] += 1
+
+    def watch(self) -> TransferWatch:
+        return TransferWatch(self.min_rate)
+
+    def stats(self) -> dict[str, int]:
+        return dict(self.dropped)
+
+
+class TransferWatch:
+    """Progress of one response body, checked against --min-rate."""
+
+    def __init__(self, min_rate: float) -> None:
+        self.min_rate = min_rate
+        self.started = time.monotonic()
+        self.sent = 0
+        # Time spent in our own --profile pacing is not the client's fault.
+        self.paced = 0.0
+
+    def advance(self, nbytes: int) -> bool:
+        """Count nbytes as written; return False once the client reads too slowly."""
+        self.sent += nbytes
+        if not self.min_rate:
+            return True
+        elapsed = time.monotonic() - self.started - self.paced
+        return elapsed < MIN_RATE_GRACE or self.sent >= self.min_rate * elapsed
+
+
+RESIZABLE_SUFFIXES = frozenset({".png", ".jpg", ".jpeg", ".webp"})
+MAX_IMAGE_DIMENSION = 4096
+DEFAULT_IMAGE_QUALITY = 80
+
+
+def parse_image_params(query: str) -> tuple[int | None, int | None, int | None] | None:
+    """Read w/h/q from a query string; None when there are none, ValueError when malformed."""
+    params = parse_qs(query)
+    if not any(name in params for name in ("w", "h", "q")):
+        return None
+    values = []
+    for name, upper in (("w", MAX_IMAGE_DIMENSION), ("h", MAX_IMAGE_DIMENSION), ("q", 100)):
+        raw = params.get(name, [None])[-1]
+        if raw is None:
+            values.append(None)
+            continue
+        if not raw.isdigit() or not 1 <= int(raw) <= upper:
+            raise ValueError(f"{name} must be an integer from 1 to {upper}")
+        values.append(int(raw))
+    return values[0], values[1], values[2]
+
+
+def _resize_image(data: bytes, out: str, width: int | None, height: int | None, quality: int) -> int:
+    """Process-pool worker: write a downscaled, re-encoded copy of an image; return its size."""
+    with Image.open(io.BytesIO(data)) as image:
+        fmt = image.format
+        # thumbnail() keeps the aspect ratio and never upscales.
+        resample = getattr(Image, "Resampling", Image).LANCZOS
+        image.thumbnail((width or image.width, height or image.height), resample)
+        if fmt == "JPEG":
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            options = {"quality": quality, "optimize": True, "progressive": True}
+        elif fmt == "WEBP":
+            options = {"quality": quality}
+        else:
+            options = {"optimize": True}
+        tmp = f"{out}.{os.getpid()}.tmp"
+        image.save(tmp, fmt, **options)
+    os.replace(tmp, out)
+    return os.path.getsize(out)
+
+
+class ImageResizer:
+    """Resized variants of images for ?w=&h=&q= requests, cached on disk.
+
+    Variants are named by a hash of the source bytes plus the parameters,
+    so a rebuild that keeps an image keeps its variants. Decoding and
+    encoding run in a process pool; concurrent requests for one variant
+    share a single job. The cache directory is trimmed, least recently
+    served first, to ``max_bytes``.
+    """
+
+    max_digests = 4096
+
+    def __init__(self, cache_dir: Path, *, max_bytes: int, workers: int = 2) -> None:
+        if Image is None:
+            raise RuntimeError("Image resizing needs Pillow (pip install Pillow)")
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.generated = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        # (path, mtime_ns, size) -> hex digest of the bytes, so a hit needs no read.
+        self._digests: dict[tuple[str, int, int], str] = {}
+        self._pending: dict[str, Future] = {}
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._size = 0
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        found = []
+        for path in cache_dir.iterdir():
+            if path.name.endswith(".tmp"):
+                continue
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                # Evicted by a sibling worker under --processes since iterdir().
+                continue
+            if stat.S_ISREG(st.st_mode):
+                found.append((st.st_atime_ns, path.name, st.st_size))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self._size += size
+        # spawn: forking a process full of serving threads is not safe.
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def variant(
+        self,
+        source: Path,
+        st: os.stat_result | FileMeta,
+        params: tuple[int | None, int | None, int | None],
+        read: Callable[[], bytes],
+    ) -> Path:
+        """Path of the variant of source for (w, h, q), generating it if needed."""
+        width, height, quality = params
+        data = None
+        digest_key = (str(source), st.st_mtime_ns, st.st_size)
+        digest = self._digests.get(digest_key)
+        if digest is None:
+            data = read()
+            digest = hashlib.sha256(data).hexdigest()[:24]
+            if len(self._digests) >= self.max_digests:
+                self._digests.clear()
+            self._digests[digest_key] = digest
+        quality = quality or DEFAULT_IMAGE_QUALITY
+        name = f"{digest}-{width or 0}x{height or 0}-q{quality}{source.suffix.lower()}"
+        path = self.cache_dir / name
+        with self._lock:
+            if name in self._entries and path.exists():
+                self._entries.move_to_end(name)
+                self.hits += 1
+                return path
+            future = self._pending.get(name)
+            owner = future is None
+            if owner:
+                if data is None:
+                    data = read()
+                future = self._pending[name] = self.pool.submit(
+                    _resize_image, data, str(path), width, height, quality
+                )
+            else:
+                self.coalesced += 1
+        if not owner:
+            future.result()
+            return path
+        try:
+            size = future.result()
+        except Exception:
+            with self._lock:
+                self.failures += 1
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(name, None)
+        with self._lock:
+            self.generated += 1
+            self.misses += 1
+            self._size += size - self._entries.pop(name, 0)
+            self._entries[name] = size
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                evicted, evicted_size = self._entries.popitem(last=False)
+                self._size -= evicted_size
+                self.evictions += 1
+                try:
+                    (self.cache_dir / evicted).unlink()
+                except OSError:
+                    pass
+        return path
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "generated": self.generated,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "failures": self.failures,
+            "bytes": self._size,
+        }
+
+    def close(self) -> None:
+        self.pool.shutdown(cancel_futures=True)
+
+
+def interim_response(status: int, headers: list[tuple[str, str]]) -> bytes:
+    """Serialize an informational (1xx) response such as 103 Early Hints."""
+    lines = [f"HTTP/1.1 {status} {http.HTTPStatus(status).phrase}"]
+    lines += [f"{name}: {value}" for name, value in headers]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+@dataclass
+class Response:
+    """A planned response, independent of the engine that writes it.
+
+    ``body`` items are bytes-like to write as-is or ``(offset, count)`` spans
+    of ``file`` to stream with sendfile. ``error`` marks a response the engine
+    should render as a standard HTML error page instead. ``route`` is the
+    route class (asset, fallback, not_found, internal) used for metrics.
+    ``early_hints`` headers go out first in a 103 to HTTP/1.1 clients.
+    ``event_stream`` asks the engine to stream live-reload events after the head.
+    ``stream`` is a body of unknown length relayed from a proxied upstream.
+    """
+
+    status: int
+    headers: list[tuple[str, str]] = field(default_factory=list)
+    body: list[bytes | memoryview | tuple[int, int]] = field(default_factory=list)
+    file: BinaryIO | None = None
+    error: str | None = None
+    route: str = "asset"
+    timings: dict[str, float] = field(default_factory=dict)
+    early_hints: list[tuple[str, str]] = field(default_factory=list)
+    event_stream: bool = False
+    stream: UpstreamBody | None = None
+
+    @property
+    def body_length(self) -> int:
+        return sum(chunk[1] if isinstance(chunk, tuple) else len(chunk) for chunk in self.body)
+
+    def __enter__(self) -> Response:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self.file is not None:
+            self.file.close()
+        if self.stream is not None:
+            self.stream.close()
+
+
+def http_date(timestamp: float) -> str:
+    return email.utils.formatdate(timestamp, usegmt=True)
+
+
+class SPASite:
+    """Path resolution and response planning shared by every serving engine."""
+
+    def __init__(
+        self,
+        root: Path,
+        *,
+        cache: AssetCache | None = None,
+        sendfile_threshold: int = 256 * 1024,
+        precompress_dir: Path | None = None,
+        cache_policy: str = "no-store",
+        index: FileIndex | None = None,
+        metrics: Metrics | None = None,
+        access_log: AccessLog | None = None,
+        preload: PreloadHints | None = None,
+        early_hints: bool = False,
+        live_reload: LiveReload | None = None,
+        builds: BuildSnapshots | None = None,
+        proxy: ReverseProxy | None = None,
+        profiles: dict[str | None, NetworkProfile] | None = None,
+        bundle: PackedBundle | None = None,
+        recorder: TraceRecorder | None = None,
+        images: ImageResizer | None = None,
+        inliner: ShellInliner | None = None,
+    ) -> None:
+        self.root = root
+        self.hashed = HashedFiles(bundle.read_bytes if bundle is not None else Path.read_bytes)
+        self.images = images
+        self.inliner = inliner
+        self.recorder = recorder
+        # A bundle stands in for both the root directory and the index.
+        self.bundle = bundle
+        if bundle is not None:
+            index = bundle
+        self.builds = builds
+        self.proxy = proxy
+        # Network profile per route class; the None key covers every class but internal.
+        self.profiles = profiles or {}
+        self.cache = cache
+        self.index = index
+        self._index_rechecked_at = 0.0
+        self.metrics = metrics
+        self.access_log = access_log
+        # Files at or above this size are streamed from the file descriptor.
+        self.sendfile_threshold = sendfile_threshold
+        self.precompress_dir = precompress_dir
+        self.cache_policy = cache_policy
+        self.preload = preload
+        self.early_hints = early_hints
+        self.live_reload = live_reload
+
+    def profile_for(self, route: str) -> NetworkProfile | None:
+        """The network profile responses of this route class are shaped to."""
+        if route in self.profiles:
+            return self.profiles[route]
+        return self.profiles.get(None) if route != "internal" else None
+
+    def current_root(self) -> Path:
+        """The build directory a new request is served from."""
+        return self.builds.current() if self.builds is not None else self.root
+
+    def sanitize_path(self, request_path: str, root: Path | None = None) -> Path:
         # Normalize URL path to avoid traversal and preserve only local path parts.
+        if root is None:
+            root = self.current_root()
         raw_path = urlsplit(request_path).path
-        path = posixpath.normpath(unquote(raw_path)).lstrip("/")
+        # Anchor at "/" first so a request-target without a leading slash
+        # cannot walk out of the root with "..".
+        path = posixpath.normpath("/" + unquote(raw_path)).lstrip("/")
         if path in ("", "."):
-            return self.root / "index.html"
-        return self.root / path
+            return root / "index.html"
+        return root / path
 
-    def _resolve_target(self, request_path: str) -> tuple[Path, bool]:
-        candidate = self._sanitize_path(request_path)
+    def resolve_target(self, request_path: str, root: Path | None = None) -> tuple[Path, str]:
+        """Map a request path to (file, route class)."""
+        if root is None:
+            root = self.current_root()
+        candidate = self.sanitize_path(request_path, root)
 
-        if candidate.exists() and candidate.is_file():
-            return candidate, True
+        if self._exists(candidate):
+            return candidate, "asset"
 
         # If the request looks like an asset file (has extension), keep 404.
         if candidate.suffix:
-            return candidate, False
+            return candidate, "not_found"
 
         # Route-like path -> SPA fallback.
-        return self.root / "index.html", True
+        return root / "index.html", "fallback"
+
+    def _exists(self, path: Path) -> bool:
+        if self.index is not None:
+            return self.index.lookup(path) is not None
+        return path.is_file()
+
+    def _previous_build(self, target: Path, root: Path) -> tuple[Path, Path] | None:
+        """Find a hashed asset the current build dropped in an older build."""
+        rel_path = target.relative_to(root).as_posix()
+        for previous in self.builds.previous():
+            candidate = previous / rel_path
+            if self._exists(candidate) and self.hashed.contains(previous, rel_path, self._stat):
+                return candidate, previous
+        return None
+
+    def _stat(self, path: Path) -> os.stat_result | FileMeta:
+        return self.index.stat(path) if self.index is not None else path.stat()
+
+    def proxy_for(self, request_path: str) -> Upstream | None:
+        return self.proxy.match(request_path) if self.proxy is not None else None
+
+    def respond(
+        self, method: str, request_path: str, request_headers: Message, body: bytes | None = None
+    ) -> Response:
+        """Plan the response to a GET or HEAD request, or any proxied request."""
+        if self.recorder is not None and urlsplit(request_path).path not in (METRICS_PATH, LIVE_RELOAD_PATH):
+            self.recorder.request(method, request_path, request_headers)
+        upstream = self.proxy_for(request_path)
+        if upstream is not None:
+            response = self.proxy.forward(upstream, method, request_path, request_headers, body)
+            return self._with_server_timing(response)
+        if self.metrics is not None and urlsplit(request_path).path == METRICS_PATH:
+            body = self.metrics.render().encode("utf-8")
+            ctype = "text/plain; version=0.0.4; charset=utf-8"
+            headers = self._entity_headers(ctype, len(body), list(NO_STORE_HEADERS))
+            return Response(200, headers, [body], route="internal")
+        if self.live_reload is not None and urlsplit(request_path).path == LIVE_RELOAD_PATH:
+            return Response(200, list(EVENT_STREAM_HEADERS), route="internal", event_stream=True)
+
+        started = time.perf_counter()
+        response = self._respond(method, request_path, request_headers)
+        if response.status == 404 and self._recheck_index():
+            # The build changed since the last generation check; retry against it.
+            started = time.perf_counter()
+            response = self._respond(method, request_path, request_headers)
+        elapsed = time.perf_counter() - started
+        resolve = response.timings.setdefault("resolve", elapsed)
+        response.timings["read"] = max(0.0, elapsed - resolve)
+        return self._with_server_timing(response)
+
+    def _recheck_index(self) -> bool:
+        """Force a build check after a 404; return whether the index was rebuilt.
+
+        A miss may be a file from a rebuild the interval check has not seen
+        yet, but a burst of 404s must not each walk every directory under
+        the refresh lock: forced checks run at most once per index interval,
+        and the rest answer from the current index.
+        """
+        if self.index is None:
+            return False
+        now = time.monotonic()
+        if now - self._index_rechecked_at < self.index.interval:
+            return False
+        self._index_rechecked_at = now
+        return self.index.refresh(force=True)
+
+    def _with_server_timing(self, response: Response) -> Response:
+        if self.metrics is not None and response.error is None:
+            server_timing = ", ".join(f"{phase};dur={value * 1000:.3f}" for phase, value in response.timings.items())
+            response.headers.append(("Server-Timing", server_timing))
+        return response
+
+    def record(
+        self,
+        response: Response,
+        request: dict[str, str],
+        body_bytes: int,
+        send_seconds: float,
+        total_seconds: float,
+    ) -> None:
+        """Called by engines once a response has been written.
+
+        ``request`` carries client, method, path and protocol for the access log.
+        """
+        if self.metrics is not None:
+            timings = {**response.timings, "send": send_seconds}
+            self.metrics.observe(response.route, response.status, body_bytes, timings, total_seconds)
+        if self.access_log is not None:
+            self.access_log.access(
+                {
+                    **request,
+                    "status": response.status,
+                    "bytes": body_bytes,
+                    "ms": round(total_seconds * 1000, 3),
+                    "route": response.route,
+                }
+            )
+
+    def _respond(self, method: str, request_path: str, request_headers: Message) -> Response:
+        started = time.perf_counter()
+        root = self.current_root()
+        if self.builds is not None and request_path.startswith(BUILDS_PREFIX):
+            build, _, rest = request_path[len(BUILDS_PREFIX) :].partition("/")
+            root = self.builds.get(build)
+            if root is None:
+                return Response(404, error="File not found", route="not_found")
+            request_path = "/" + rest
+        target, route = self.resolve_target(request_path, root)
+        if route == "not_found" and self.builds is not None:
+            found = self._previous_build(target, root)
+            if found is not None:
+                (target, root), route = found, "asset"
+        if route == "not_found":
+            return Response(404, error="File not found", route=route)
+        if self.images is not None and target.suffix.lower() in RESIZABLE_SUFFIXES:
+            try:
+                params = parse_image_params(urlsplit(request_path).query)
+            except ValueError as exc:
+                return Response(400, error=f"Bad image parameters: {exc}", route=route)
+            if params is not None:
+                return self._resized_image(method, request_headers, target, params, root, route)
+
+        if self.index is not None:
+            # The fallback index.html is never checked against the index, and
+            # it is briefly missing mid-rebuild.
+            meta = self.index.lookup(target)
+            if meta is None:
+                return Response(404, error="File not found", route="not_found")
+            ctype = meta.ctype
+        else:
+            ctype = mimetypes.guess_type(str(target))[0] or "application/octet-stream"
+        source = target
+        headers: list[tuple[str, str]] = []
+        inject = self.live_reload is not None and source == root / "index.html"
+        inline = self.inliner is not None and source == root / "index.html"
+        if target.suffix in COMPRESSIBLE_SUFFIXES and not inject and not inline:
+            headers.append(("Vary", "Accept-Encoding"))
+            # Ranges are always served against the identity representation.
+            encodings = (
+                []
+                if "Range" in request_headers
+                else acceptable_encodings(request_headers.get("Accept-Encoding"))
+            )
+            variant = find_precompressed(target, root, self.precompress_dir, encodings, self._stat)
+            if variant is not None:
+                target, coding = variant
+                headers.append(("Content-Encoding", coding))
+
+        try:
+            st = self._stat(target)
+        except OSError:
+            return Response(404, error="File not found", route="not_found")
+
+        headers.extend(self._cache_headers(source, st, root))
+        if self._not_modified(request_headers, headers, st):
+            kept = [(name, value) for name, value in headers if name in NOT_MODIFIED_HEADERS]
+            return Response(304, kept, route=route)
+
+        shell = None
+        if inline:
+            try:
+                shell = self.inliner.shell(root, self._stat)
+            except OSError:
+                return Response(404, error="File not found", route="not_found")
+
+        link = None
+        if self.preload is not None and source == root / "index.html":
+            shell_st = st if source == target else self._stat(source)
+            link = self.preload.link_header(root, shell_st.st_mtime_ns)
+            if link and shell is not None and shell.inlined:
+                link = ", ".join(value for value in link.split(", ") if value[1 : value.index(">")] not in shell.inlined)
+            if link:
+                headers.append(("Link", link))
+
+        resolved = time.perf_counter() - started
+        if shell is not None:
+            response = self._inlined_shell(method, shell, ctype, headers, st, request_headers)
+        elif inject:
+            response = self._live_shell(method, target, ctype, headers, st)
+        else:
+            response = self._read_target(method, target, ctype, headers, st, request_headers)
+        response.route = route if response.status != 404 else "not_found"
+        response.timings["resolve"] = resolved
+        if link and self.early_hints and method == "GET" and response.status == 200:
+            response.early_hints = [("Link", link)]
+        return response
+
+    def _read_target(
+        self,
+        method: str,
+        target: Path,
+        ctype: str,
+        headers: list[tuple[str, str]],
+        st: os.stat_result | FileMeta,
+        request_headers: Message,
+    ) -> Response:
+        headers.append(("Accept-Ranges", "bytes"))
+        if method == "GET" and self._range_applies(request_headers, st):
+            return self._range_response(target, ctype, headers, request_headers["Range"], st)
+
+        if method == "HEAD":
+            return Response(200, self._entity_headers(ctype, st.st_size, headers))
+
+        if self.bundle is not None:
+            return Response(200, self._entity_headers(ctype, st.st_size, headers), [st.data])
+
+        if st.st_size >= self.sendfile_threshold:
+            return self._file_response(target, ctype, headers)
+
+        try:
+            if self.cache is not None:
+                data, hit = self.cache.get(target, st if self.index is not None else None)
+                headers.append(("X-Cache", "HIT" if hit else "MISS"))
+            else:
+                data = target.read_bytes()
+        except OSError:
+            return Response(404, error="File not found")
+
+        return Response(200, self._entity_headers(ctype, len(data), headers), [data])
+
+    def _resized_image(
+        self,
+        method: str,
+        request_headers: Message,
+        source: Path,
+        params: tuple[int | None, int | None, int | None],
+        root: Path,
+        route: str,
+    ) -> Response:
+        try:
+            source_st = self._stat(source)
+            read = (lambda: bytes(source_st.data)) if self.bundle is not None else source.read_bytes
+            variant = self.images.variant(source, source_st, params, read)
+            st = os.stat(variant)
+        except FileNotFoundError:
+            return Response(404, error="File not found", route="not_found")
+        except Exception as exc:
+            # Pillow could not decode the source, or the worker process died.
+            return Response(415, error=f"Cannot resize image ({exc})", route=route)
+        ctype = mimetypes.guess_type(source.name)[0] or "application/octet-stream"
+        headers = list(self._cache_headers(source, st, root))
+        if self._not_modified(request_headers, headers, st):
+            kept = [(name, value) for name, value in headers if name in NOT_MODIFIED_HEADERS]
+            return Response(304, kept, route=route)
+        if method == "HEAD":
+            return Response(200, self._entity_headers(ctype, st.st_size, headers), route=route)
+        response = self._file_response(variant, ctype, headers)
+        response.route = route if response.status != 404 else "not_found"
+        return response
+
+    def _live_shell(
+        self,
+        method: str,
+        target: Path,
+        ctype: str,
+        headers: list[tuple[str, str]],
+        st: os.stat_result | FileMeta,
+    ) -> Response:
+        try:
+            if self.bundle is not None:
+                data = bytes(st.data)
+            elif self.cache is not None:
+                data, _ = self.cache.get(target, st if self.index is not None else None)
+            else:
+                data = target.read_bytes()
+        except OSError:
+            return Response(404, error="File not found")
+        # The snippet carries the build it was served with, so a tab that
+        # loaded just before a rebuild still reloads on its first event.
+        data = self.live_reload.inject(data, build_id(st))
+        return Response(200, self._entity_headers(ctype, len(data), headers), [data] if method == "GET" else [])
+
+    def _inlined_shell(
+        self,
+        method: str,
+        shell: InlinedShell,
+        ctype: str,
+        headers: list[tuple[str, str]],
+        st: os.stat_result | FileMeta,
+        request_headers: Message,
+    ) -> Response:
+        data = shell.data
+        if self.live_reload is not None:
+            data = self.live_reload.inject(data, build_id(st))
+        else:
+            headers.append(("Vary", "Accept-Encoding"))
+            for coding, _ in acceptable_encodings(request_headers.get("Accept-Encoding")):
+                if coding in shell.encoded:
+                    data = shell.encoded[coding]
+                    headers.append(("Content-Encoding", coding))
+                    break
+        return Response(200, self._entity_headers(ctype, len(data), headers), [data] if method == "GET" else [])
+
+    def _file_response(self, target: Path, ctype: str, headers: list[tuple[str, str]]) -> Response:
+        try:
+            f = open(target, "rb")
+        except OSError:
+            return Response(404, error="File not found")
+        size = os.fstat(f.fileno()).st_size
+        return Response(200, self._entity_headers(ctype, size, headers), [(0, size)], f)
+
+    def _range_applies(self, request_headers: Message, st: os.stat_result | FileMeta) -> bool:
+        if "Range" not in request_headers:
+            return False
+        if_range = request_headers.get("If-Range")
+        if if_range is None:
+            return True
+        if_range = if_range.strip()
+        if if_range.startswith('"'):
+            return if_range == make_etag(st)
+        return if_range == http_date(st.st_mtime)
+
+    def _range_response(
+        self,
+        target: Path,
+        ctype: str,
+        headers: list[tuple[str, str]],
+        range_header: str,
+        st: os.stat_result | FileMeta,
+    ) -> Response:
+        f = None
+        if self.bundle is not None:
+            size = st.st_size
+        else:
+            try:
+                f = open(target, "rb")
+            except OSError:
+                return Response(404, error="File not found")
+            size = os.fstat(f.fileno()).st_size
+
+        def part(start: int, count: int) -> memoryview | tuple[int, int]:
+            # Packed files are sliced from the mapping; files on disk go out with sendfile.
+            return (start, count) if f is not None else st.data[start : start + count]
+
+        spans = parse_range(range_header, size)
+        if spans is None:
+            return Response(200, self._entity_headers(ctype, size, headers), [part(0, size)], f)
+        if not spans:
+            if f is not None:
+                f.close()
+            return Response(
+                416, [("Accept-Ranges", "bytes"), ("Content-Range", f"bytes */{size}"), ("Content-Length", "0")]
+            )
+        if len(spans) == 1:
+            start, end = spans[0]
+            headers.append(("Content-Range", f"bytes {start}-{end}/{size}"))
+            return Response(
+                206, self._entity_headers(ctype, end - start + 1, headers), [part(start, end - start + 1)], f
+            )
+
+        boundary = secrets.token_hex(12)
+        body: list[bytes | memoryview | tuple[int, int]] = []
+        length = 0
+        for start, end in spans:
+            head = (
+                f"--{boundary}\r\nContent-Type: {ctype}\r\n"
+                f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+            ).encode("latin-1")
+            body += [head, part(start, end - start + 1), b"\r\n"]
+            length += len(head) + end - start + 1 + 2
+        closing = f"--{boundary}--\r\n".encode("latin-1")
+        body.append(closing)
+        length += len(closing)
+        mtype = f"multipart/byteranges; boundary={boundary}"
+        return Response(206, self._entity_headers(mtype, length, headers), body, f)
+
+    def _cache_headers(
+        self, source: Path, st: os.stat_result | FileMeta, root: Path
+    ) -> tuple[tuple[str, str], ...]:
+        if self.cache_policy == "no-store" or source == root / "index.html":
+            # The SPA shell must never be cached: it names the current hashes.
+            return NO_STORE_HEADERS
+        validators = (("ETag", make_etag(st)), ("Last-Modified", http_date(st.st_mtime)))
+        if self.hashed.contains(root, source.relative_to(root).as_posix(), self._stat):
+            return (("Cache-Control", IMMUTABLE_CACHE_CONTROL), *validators)
+        return (("Cache-Control", "no-cache"), *validators)
+
+    def _not_modified(
+        self, request_headers: Message, headers: list[tuple[str, str]], st: os.stat_result | FileMeta
+    ) -> bool:
+        etag = next((value for name, value in headers if name == "ETag"), None)
+        if etag is None:
+            return False
+        if_none_match = request_headers.get("If-None-Match")
+        if if_none_match is not None:
+            return etag_matches(if_none_match, etag)
+        if_modified_since = request_headers.get("If-Modified-Since")
+        if if_modified_since is None:
+            return False
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return since.tzinfo is not None and int(st.st_mtime) <= since.timestamp()
+
+    @staticmethod
+    def _entity_headers(ctype: str, length: int, headers: list[tuple[str, str]]) -> list[tuple[str, str]]:
+        return [("Content-Type", ctype), ("Content-Length", str(length)), *headers]
+
+
+class OpenConnections:
+    """The threaded engine's open connections, for a graceful drain on shutdown.
+
+    A connection is busy from its request line until the response is out.
+    Draining shuts idle connections (including event streams) at once and
+    lets busy ones finish, with Connection: close, until a timeout.
+    """
+
+    def __init__(self) -> None:
+        self.draining = False
+        self._cond = threading.Condition()
+        self._busy: dict[socket.socket, bool] = {}
+
+    def add(self, sock: socket.socket) -> None:
+        with self._cond:
+            self._busy[sock] = False
+
+    def discard(self, sock: socket.socket) -> None:
+        with self._cond:
+            self._busy.pop(sock, None)
+            self._cond.notify_all()
+
+    def busy(self, sock: socket.socket) -> None:
+        with self._cond:
+            self._busy[sock] = True
+
+    def idle(self, sock: socket.socket) -> None:
+        with self._cond:
+            self._busy[sock] = False
+            self._cond.notify_all()
+            if self.draining:
+                self._shut(sock)
+
+    def drain(self, timeout: float) -> int:
+        """Close idle connections, wait for busy ones; return how many were cut off."""
+        with self._cond:
+            self.draining = True
+            for sock, busy in self._busy.items():
+                if not busy:
+                    self._shut(sock)
+            self._cond.wait_for(lambda: not any(self._busy.values()), timeout)
+            return sum(self._busy.values())
+
+    @staticmethod
+    def _shut(sock: socket.socket) -> None:
+        # Wakes the handler thread blocked in recv() with end-of-stream.
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class _DeadlineReader(io.RawIOBase):
+    """Socket reads for SPAHandler, bounded per phase rather than per recv.
+
+    A per-recv timeout lets a client trickle one byte at a time forever. Here
+    each phase (waiting idle for a request, receiving its head) has one
+    deadline, and a read past it fails with TimeoutError. An idle wait turns
+    into the header phase as soon as the next request's first bytes arrive.
+    """
+
+    def __init__(self, sock: socket.socket, limits: ConnectionLimits) -> None:
+        self.sock = sock
+        self.limits = limits
+        self.phase = "header"
+        self.deadline: float | None = None
+
+    def arm(self, phase: str, timeout: float) -> None:
+        self.phase = phase
+        self.deadline = time.monotonic() + timeout if timeout > 0 else None
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        remaining = None
+        if self.deadline is not None:
+            remaining = self.deadline - time.monotonic()
+            if remaining <= 0:
+                self.limits.drop(self.phase)
+                raise TimeoutError(f"{self.phase} timeout")
+        self.sock.settimeout(remaining)
+        try:
+            received = self.sock.recv_into(buffer)
+        except TimeoutError:
+            self.limits.drop(self.phase)
+            raise
+        if received and self.phase == "idle":
+            self.arm("header", self.limits.header_timeout)
+        return received
+
+
+class SPAHandler(http.server.SimpleHTTPRequestHandler):
+    site: SPASite
+    limits = ConnectionLimits()
+    connections = OpenConnections()
+    # Set while _send_target runs; it logs the request itself once the body is out.
+    _deferred_log = False
+
+    def setup(self) -> None:
+        super().setup()
+        # One handler instance serves every request on its connection.
+        self.throttle = Throttle()
+        self._watch = self.limits.watch()
+        self._requests = 0
+        self._reader = _DeadlineReader(self.connection, self.limits)
+        # Closing makefile()'s reader releases its hold on the socket.
+        self.rfile.close()
+        self.rfile = io.BufferedReader(self._reader)
+        self.connections.add(self.connection)
+
+    def finish(self) -> None:
+        self.connections.discard(self.connection)
+        super().finish()
+
+    def handle_one_request(self) -> None:
+        # A new connection should send its request promptly; later ones may
+        # sit out the keep-alive idle timeout first.
+        if self._requests:
+            if self.connections.draining:
+                self.close_connection = True
+                return
+            self._reader.arm("idle", self.limits.idle_timeout)
+        else:
+            self._reader.arm("header", self.limits.header_timeout)
+        self._requests += 1
+        try:
+            super().handle_one_request()
+        finally:
+            self.connections.idle(self.connection)
+
+    def parse_request(self) -> bool:
+        self.connections.busy(self.connection)
+        return super().parse_request()
+
+    def address_string(self) -> str:
+        return peer_label(self.client_address)
 
     def _send_target(self, with_body: bool) -> None:
-        target, ok = self._resolve_target(self.path)
-        if not ok:
-            self.send_error(404, "File not found")
-            return
+        started = time.perf_counter()
+        body = None
+        if self.site.proxy_for(self.path) is not None:
+            rejected = check_request_body(self.headers)
+            if rejected is not None:
+                self.close_connection = True
+                self.send_error(*rejected)
+                return
+            length = int(self.headers.get("Content-Length", "0"))
+            body = self.rfile.read(length) if length else None
+        else:
+            # Discard any request body so the next request on the stream lines up.
+            length = self.headers.get("Content-Length")
+            if length:
+                if not length.isdigit() or int(length) > MAX_DISCARDED_BODY:
+                    self.close_connection = True
+                else:
+                    self.rfile.read(int(length))
+            if "Transfer-Encoding" in self.headers:
+                self.close_connection = True
+        self._deferred_log = True
+        with self.site.respond(self.command, self.path, self.headers, body) as response:
+            send_started = time.perf_counter()
+            body_bytes = response.body_length if with_body else 0
+            self.connection.settimeout(self.limits.write_timeout or None)
+            latency = self.throttle.use(self.site.profile_for(response.route))
+            if latency:
+                time.sleep(latency)
+            self._watch = self.limits.watch()
+            if response.error is not None:
+                self.send_error(response.status, response.error)
+            else:
+                if response.early_hints and self.request_version == self.protocol_version == "HTTP/1.1":
+                    self.wfile.write(interim_response(103, response.early_hints))
+                self.send_response(response.status)
+                for name, value in response.headers:
+                    self.send_header(name, value)
+                if response.event_stream or self.connections.draining:
+                    self.send_header("Connection", "close")
+                chunked = response.stream is not None and self._frame_stream(response.headers)
+                self.end_headers()
+                if with_body:
+                    try:
+                        for chunk in response.body:
+                            if isinstance(chunk, tuple):
+                                self._send_file(response.file, *chunk)
+                            else:
+                                self._write(chunk)
+                    except TimeoutError:
+                        # Counted by _write/_send_file; the body is cut short.
+                        self.close_connection = True
+                if response.stream is not None:
+                    body_bytes = self._relay(response.stream, chunked)
+        if response.event_stream and with_body:
+            # Open until the tab goes away; a drain need not wait for it.
+            self.connections.idle(self.connection)
+            if isinstance(self.server, PooledHTTPServer):
+                # A stream would hold a pool worker for as long as the tab
+                # stays open; a few tabs could starve every other request.
+                self._deferred_log = False
+                request = self._request_info()
+
+                def stream() -> None:
+                    sent = self._stream_events()
+                    finished = time.perf_counter()
+                    self.site.record(response, request, sent, finished - send_started, finished - started)
+
+                self.server.run_detached(self.connection, stream)
+                return
+            body_bytes = self._stream_events()
+        finished = time.perf_counter()
+        self._deferred_log = False
+        self.site.record(response, self._request_info(), body_bytes, finished - send_started, finished - started)
 
-        ctype = mimetypes.guess_type(str(target))[0] or "application/octet-stream"
+    def _frame_stream(self, headers: list[tuple[str, str]]) -> bool:
+        """Pick framing for a body of unknown length; return whether it is chunked."""
+        if any(name.lower() == "content-length" for name, _ in headers):
+            return False
+        if self.request_version == self.protocol_version == "HTTP/1.1":
+            self.send_header("Transfer-Encoding", "chunked")
+            return True
+        self.send_header("Connection", "close")
+        return False
+
+    def _relay(self, stream: UpstreamBody, chunked: bool) -> int:
+        sent = 0
         try:
-            data = target.read_bytes()
+            for chunk in stream:
+                self._write(b"%x\r\n%s\r\n" % (len(chunk), chunk) if chunked else chunk)
+                sent += len(chunk)
+            if chunked:
+                self.wfile.write(b"0\r\n\r\n")
         except OSError:
-            self.send_error(404, "File not found")
-            return
+            # Client went away or the upstream broke off: this connection is done.
+            self.close_connection = True
+        return sent
+
+    def _stream_events(self) -> int:
+        # Holds this handler thread for as long as the tab stays open.
+        live = self.site.live_reload
+        build = None
+        sent = 0
+        try:
+            while True:
+                current = live.wait(build, LIVE_RELOAD_HEARTBEAT)
+                chunk = live.event(current) if current != build else b": ping\n\n"
+                build = current
+                # On the socket itself: a detached stream outlives self.wfile.
+                self.connection.sendall(chunk)
+                sent += len(chunk)
+        except OSError:
+            return sent
+
+    def _request_info(self) -> dict[str, str]:
+        return {
+            "client": self.address_string(),
+            "method": self.command,
+            "path": self.path,
+            "proto": self.request_version,
+        }
+
+    def _write(self, data: bytes | memoryview) -> None:
+        step = self.limits.slice_bytes
+        if len(data) > step:
+            data = memoryview(data)
+        for start in range(0, len(data), step):
+            for delay, piece in self.throttle.pieces(data[start : start + step]):
+                if delay:
+                    time.sleep(delay)
+                    self._watch.paced += delay
+                try:
+                    self.wfile.write(piece)
+                except TimeoutError:
+                    self.limits.drop("write")
+                    raise
+                self._check_rate(len(piece))
+
+    def _send_file(self, f, offset: int, count: int) -> None:
+        # socket.sendfile() uses os.sendfile where the platform supports it and
+        # falls back to chunked read/send otherwise, so memory stays flat.
+        self.wfile.flush()
+        for delay, start, size in self.throttle.spans(offset, count):
+            if delay:
+                time.sleep(delay)
+                self._watch.paced += delay
+            # Whole spans unless --min-rate needs to look at progress.
+            step = self.limits.slice_bytes if self.limits.min_rate else max(size, 1)
+            for part in range(start, start + size, step):
+                part_size = min(step, start + size - part)
+                try:
+                    sent = self.connection.sendfile(f, part, part_size)
+                except TimeoutError:
+                    self.limits.drop("write")
+                    raise
+                if sent < part_size:
+                    # File shrank underneath us; the declared length can't be honoured.
+                    self.close_connection = True
+                    return
+                self._check_rate(sent)
 
-        self.send_response(200)
-        self.send_header("Content-Type", ctype)
-        self.send_header("Content-Length", str(len(data)))
-        # Prevent stale index/assets causing blank screen due to hash mismatch.
-        self.send_header("Cache-Control", "no-store, no-cache, must-revalidate")
-        self.send_header("Pragma", "no-cache")
-        self.send_header("Expires", "0")
-        self.end_headers()
-        if with_body:
-            self.wfile.write(data)
+    def _check_rate(self, nbytes: int) -> None:
+        if not self._watch.advance(nbytes):
+            self.limits.drop("slow")
+            raise TimeoutError("client reading below --min-rate")
 
     def do_GET(self) -> None:
         self._send_target(with_body=True)
@@ -71,8 +3008,905 @@ class SPAHandler(http.server.SimpleHTTPRequestHandler):
     def do_HEAD(self) -> None:
         self._send_target(with_body=False)
 
+    def _proxy_only(self) -> None:
+        if self.site.proxy_for(self.path) is None:
+            self.send_error(http.HTTPStatus.NOT_IMPLEMENTED, f"Unsupported method ({self.command!r})")
+            return
+        self._send_target(with_body=True)
+
+    do_POST = do_PUT = do_PATCH = do_DELETE = do_OPTIONS = _proxy_only
+
+    def log_request(self, code: int | str = "-", size: int | str = "-") -> None:
+        # Requests that never reach _send_target (bad syntax, unsupported
+        # method) are logged here, without timing.
+        if self._deferred_log or self.site.access_log is None:
+            return
+        status = code.value if isinstance(code, http.HTTPStatus) else code
+        request = self._request_info() if self.command else {"client": self.address_string()}
+        self.site.access_log.access({**request, "status": status, "route": "internal"})
+
     def log_message(self, fmt: str, *args) -> None:
-        print(fmt % args)
+        if self.site.access_log is not None:
+            self.site.access_log.message("info", fmt % args)
+
+    def log_error(self, fmt: str, *args) -> None:
+        # Timeouts are routine for idle keep-alive connections and counted by reason in metrics.
+        if fmt.startswith("Request timed out"):
+            return
+        # send_error's 4xx are the client's doing; their (sampled) access
+        # record is enough, so --quiet and --log-sample apply to them.
+        if fmt.startswith("code ") and args and int(args[0]) < 500:
+            return
+        if self.site.access_log is not None:
+            self.site.access_log.message("error", fmt % args)
+
+
+class PooledHTTPServer(http.server.HTTPServer):
+    """HTTPServer that hands connections to a fixed pool of worker threads.
+
+    Accepted connections wait in a bounded queue. Once it is full, new
+    connections are answered with 503 + Retry-After and closed, so overload
+    degrades into fast rejections instead of an ever-growing thread count.
+    """
+
+    def __init__(
+        self,
+        server_address: tuple[str, int],
+        handler_class: type[http.server.BaseHTTPRequestHandler],
+        *,
+        workers: int,
+        queue_depth: int,
+        retry_after: int = 1,
+        bind_and_activate: bool = True,
+    ) -> None:
+        super().__init__(server_address, handler_class, bind_and_activate)
+        self.retry_after = retry_after
+        self.shed = 0
+        self._detached_lock = threading.Lock()
+        self._detached: set[socket.socket] = set()
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, queue_depth))
+        self._workers = [
+            threading.Thread(target=self._work, name=f"spa-worker-{i}", daemon=True) for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def process_request(self, request, client_address) -> None:
+        try:
+            self._queue.put_nowait((request, client_address))
+        except queue.Full:
+            self._shed(request)
+
+    def _work(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                with self._detached_lock:
+                    detached = request in self._detached
+                    self._detached.discard(request)
+                if not detached:
+                    self.shutdown_request(request)
+
+    def run_detached(self, request, target: Callable[[], None]) -> None:
+        """Finish a connection on its own daemon thread and free this pool worker.
+
+        For responses that stay open indefinitely, i.e. live-reload event
+        streams; the thread closes the connection when target returns.
+        """
+        with self._detached_lock:
+            self._detached.add(request)
+
+        def run() -> None:
+            try:
+                target()
+            finally:
+                self.shutdown_request(request)
+
+        threading.Thread(target=run, name="spa-event-stream", daemon=True).start()
+
+    def _shed(self, request) -> None:
+        self.shed += 1
+        body = b"Server busy, retry shortly.\n"
+        head = (
+            "HTTP/1.1 503 Service Unavailable\r\n"
+            f"Retry-After: {self.retry_after}\r\n"
+            "Content-Type: text/plain; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode("latin-1")
+        try:
+            # Best effort and never blocking: the accept loop must stay fast.
+            request.setblocking(False)
+            request.send(head + body)
+            request.recv(65536)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def stats(self) -> dict[str, int]:
+        return {"workers": len(self._workers), "queued": self._queue.qsize(), "shed": self.shed}
+
+    def server_close(self) -> None:
+        super().server_close()
+        for _ in self._workers:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+
+
+class AsyncSPAServer:
+    """HTTP/1.1 keep-alive server on asyncio streams, serving an SPASite.
+
+    Responses are planned by the same SPASite as the threaded engine, in a
+    small thread pool so stat/read calls never block the event loop; file
+    bodies go out through loop.sendfile().
+    """
+
+    server_version = f"{SPAHandler.server_version} {SPAHandler.sys_version}"
+    max_header_lines = 100
+
+    def __init__(
+        self,
+        site: SPASite,
+        *,
+        keep_alive_timeout: float = 5.0,
+        io_threads: int = 4,
+        limits: ConnectionLimits | None = None,
+        drain_timeout: float = 10.0,
+    ) -> None:
+        self.site = site
+        self.keep_alive_timeout = keep_alive_timeout
+        self.limits = limits or ConnectionLimits(idle_timeout=keep_alive_timeout)
+        self.drain_timeout = drain_timeout
+        self.draining = False
+        # Connection task -> whether it is mid-request, for the shutdown drain.
+        self._connections: dict[asyncio.Task, bool] = {}
+        self.executor = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix="spa-io")
+        # Requests waiting for a pooled upstream connection block a proxy
+        # thread; bodies already flowing relay on their own threads so they
+        # can always finish and hand their connection back.
+        proxy_threads = max(1, sum(upstream.pool_size for upstream in site.proxy.upstreams) if site.proxy else 0)
+        self.proxy_executor = ThreadPoolExecutor(max_workers=proxy_threads, thread_name_prefix="spa-proxy")
+        self.relay_executor = ThreadPoolExecutor(max_workers=proxy_threads, thread_name_prefix="spa-relay")
+
+    async def serve(
+        self,
+        sock: socket.socket,
+        ready: Callable[[], None] | None = None,
+        stop_signals: tuple[int, ...] = (),
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(self.executor)
+        # asyncio.run() already turns SIGINT into a clean cancellation; other
+        # stop signals must not raise inside whichever callback is running.
+        stop = asyncio.Event()
+        for signum in stop_signals:
+            loop.add_signal_handler(signum, stop.set)
+        server = await asyncio.start_server(self._handle_connection, sock=sock)
+        if ready is not None:
+            ready()
+        try:
+            await stop.wait()
+        finally:
+            # Also reached when SIGINT cancels this task.
+            server.close()
+            await self._drain_connections()
+
+    async def _drain_connections(self) -> None:
+        """Close idle connections and give busy ones drain_timeout to finish."""
+        self.draining = True
+        for task, busy in list(self._connections.items()):
+            if not busy:
+                task.cancel()
+        busy = [task for task, busy in self._connections.items() if busy]
+        if busy and self.drain_timeout > 0:
+            await asyncio.wait(busy, timeout=self.drain_timeout)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        throttle = Throttle()
+        first = True
+        task = asyncio.current_task()
+        self._connections[task] = False
+        abort = False
+        try:
+            while await self._handle_request(reader, writer, throttle, first) and not self.draining:
+                self._connections[task] = False
+                first = False
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            # Timed out, dropped as too slow, or reset. A graceful close would
+            # wait on the unsent body forever, holding the slot it should free.
+            abort = True
+        except asyncio.CancelledError:
+            # Server shutdown. Finishing normally keeps asyncio from logging
+            # every idle keep-alive connection as a failed task.
+            abort = True
+        finally:
+            self._connections.pop(task, None)
+            if abort:
+                writer.transport.abort()
+            else:
+                writer.close()
+                try:
+                    await asyncio.wait_for(writer.wait_closed(), CLOSE_TIMEOUT)
+                except (asyncio.TimeoutError, asyncio.CancelledError, ConnectionError):
+                    writer.transport.abort()
+
+    async def _within(self, awaitable, deadline: float | None, phase: str):
+        """Await a read that must finish by deadline (loop time); count it if it does not."""
+        loop = asyncio.get_running_loop()
+        try:
+            return await asyncio.wait_for(awaitable, None if deadline is None else max(0.0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            self.limits.drop(phase)
+            raise
+
+    async def _handle_request(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, throttle: Throttle, first: bool
+    ) -> bool:
+        """Serve one request; return whether the connection stays open."""
+        loop = asyncio.get_running_loop()
+        limits = self.limits
+        idle_timeout = self.keep_alive_timeout if self.keep_alive_timeout > 0 else None
+        header_timeout = limits.header_timeout if limits.header_timeout > 0 else None
+        # A new connection should send its request promptly; later ones may
+        # sit out the keep-alive idle timeout first. Once the first byte is
+        # in, the whole head must arrive within the header timeout.
+        phase, wait = ("header", header_timeout) if first else ("idle", idle_timeout)
+        lead = await self._within(reader.read(1), None if wait is None else loop.time() + wait, phase)
+        if not lead:
+            return False
+        self._connections[asyncio.current_task()] = True
+        deadline = None if header_timeout is None else loop.time() + header_timeout
+        try:
+            raw_line = lead + await self._within(reader.readline(), deadline, "header")
+        except ValueError:
+            await self._send_simple_error(writer, "HTTP/1.1", 414, "Request-URI Too Long")
+            return False
+        request_line = raw_line.decode("iso-8859-1").rstrip("\r\n")
+        words = request_line.split()
+        if len(words) != 3 or not words[2].startswith("HTTP/"):
+            await self._send_simple_error(writer, "HTTP/1.1", 400, f"Bad request syntax ({request_line!r})")
+            return False
+        method, path, version = words
+
+        header_lines = []
+        while True:
+            try:
+                line = await self._within(reader.readline(), deadline, "header")
+            except ValueError:
+                await self._send_simple_error(writer, version, 431, "Line too long")
+                return False
+            if line in (b"\r\n", b"\n", b""):
+                break
+            header_lines.append(line)
+            if len(header_lines) > self.max_header_lines:
+                await self._send_simple_error(writer, version, 431, "Too many headers")
+                return False
+        request_headers = http.client.parse_headers(io.BytesIO(b"".join(header_lines) + b"\r\n"))
+
+        connection = request_headers.get("Connection", "").lower()
+        if idle_timeout is None:
+            keep_alive = False
+        elif version == "HTTP/1.1":
+            keep_alive = connection != "close"
+        else:
+            keep_alive = connection == "keep-alive"
+        upstream = self.site.proxy_for(path)
+        body = None
+        if upstream is not None:
+            rejected = check_request_body(request_headers)
+            if rejected is not None:
+                await self._send_simple_error(writer, version, *rejected)
+                return False
+            length = int(request_headers.get("Content-Length", "0"))
+            body = await self._within(reader.readexactly(length), deadline, "header") if length else None
+        else:
+            # Discard any request body so the next request on the stream lines up.
+            length = request_headers.get("Content-Length")
+            if length:
+                if not length.isdigit() or int(length) > MAX_DISCARDED_BODY:
+                    keep_alive = False
+                else:
+                    await self._within(reader.readexactly(int(length)), deadline, "header")
+            if "Transfer-Encoding" in request_headers:
+                keep_alive = False
+
+        if method not in ("GET", "HEAD") and upstream is None:
+            await self._send_simple_error(writer, version, 501, f"Unsupported method ({method!r})")
+            return False
+
+        started = time.perf_counter()
+        # Upstream calls block for as long as the backend takes; keep them off the file I/O pool.
+        executor = self.proxy_executor if upstream is not None else None
+        response = await loop.run_in_executor(executor, self.site.respond, method, path, request_headers, body)
+        send_started = time.perf_counter()
+        body_bytes = 0
+        with response:
+            latency = throttle.use(self.site.profile_for(response.route))
+            if latency:
+                await asyncio.sleep(latency)
+            watch = limits.watch()
+            keep_alive = keep_alive and not self.draining
+            if response.error is not None:
+                await self._send_simple_error(writer, version, response.status, response.error, method, keep_alive)
+            elif response.event_stream:
+                keep_alive = False
+                self._write_head(writer, version, response.status, response.headers, keep_alive)
+                if method == "GET":
+                    # Open until the tab goes away; a drain need not wait for it.
+                    self._connections[asyncio.current_task()] = False
+                    body_bytes = await self._stream_events(writer)
+            else:
+                headers = response.headers
+                chunked = False
+                if response.stream is not None and not any(name.lower() == "content-length" for name, _ in headers):
+                    if version == "HTTP/1.1":
+                        headers, chunked = [*headers, ("Transfer-Encoding", "chunked")], True
+                    else:
+                        keep_alive = False
+                if response.early_hints and version == "HTTP/1.1":
+                    writer.write(interim_response(103, response.early_hints))
+                self._write_head(writer, version, response.status, headers, keep_alive)
+                if response.stream is not None:
+                    body_bytes, complete = await self._relay(writer, response.stream, chunked, throttle, watch)
+                    keep_alive = keep_alive and complete
+                if method == "GET":
+                    for chunk in response.body:
+                        if not isinstance(chunk, tuple):
+                            await self._write(writer, chunk, throttle, watch)
+                        elif not await self._send_file(writer, response.file, *chunk, throttle, watch):
+                            keep_alive = False
+                            break
+                await self._drain(writer)
+        finished = time.perf_counter()
+        if not response.event_stream and response.stream is None:
+            body_bytes = response.body_length if method == "GET" else 0
+        request = {
+            "client": peer_label(writer.get_extra_info("peername")),
+            "method": method,
+            "path": path,
+            "proto": version,
+        }
+        self.site.record(response, request, body_bytes, finished - send_started, finished - started)
+        return keep_alive
+
+    async def _relay(
+        self,
+        writer: asyncio.StreamWriter,
+        stream: UpstreamBody,
+        chunked: bool,
+        throttle: Throttle,
+        watch: TransferWatch,
+    ) -> tuple[int, bool]:
+        """Copy a proxied body to the client; return bytes sent and whether it completed."""
+        loop = asyncio.get_running_loop()
+        sent = 0
+        try:
+            while (chunk := await loop.run_in_executor(self.relay_executor, next, stream, None)) is not None:
+                await self._write(writer, b"%x\r\n%s\r\n" % (len(chunk), chunk) if chunked else chunk, throttle, watch)
+                await self._drain(writer)
+                sent += len(chunk)
+        except ConnectionAbortedError:
+            # The upstream broke off; closing tells the client the body is short.
+            return sent, False
+        if chunked:
+            writer.write(b"0\r\n\r\n")
+        return sent, True
+
+    async def _write(
+        self, writer: asyncio.StreamWriter, data: bytes | memoryview, throttle: Throttle, watch: TransferWatch
+    ) -> None:
+        step = self.limits.slice_bytes
+        large = len(data) > step
+        if large:
+            data = memoryview(data)
+        for start in range(0, len(data), step):
+            piece_bytes = 0
+            for delay, piece in throttle.pieces(data[start : start + step]):
+                if delay:
+                    await self._drain(writer)
+                    await asyncio.sleep(delay)
+                    watch.paced += delay
+                writer.write(piece)
+                piece_bytes += len(piece)
+            if large:
+                # Let each slice go out, so a stalled reader hits the write
+                # timeout and the transfer rate can be checked.
+                await self._drain(writer)
+                self._check_rate(watch, piece_bytes)
+
+    async def _send_file(
+        self,
+        writer: asyncio.StreamWriter,
+        f: BinaryIO,
+        offset: int,
+        count: int,
+        throttle: Throttle,
+        watch: TransferWatch,
+    ) -> bool:
+        """Send a span of f; return False if the file came up short."""
+        loop = asyncio.get_running_loop()
+        await self._drain(writer)
+        for delay, start, size in throttle.spans(offset, count):
+            if delay:
+                await asyncio.sleep(delay)
+                watch.paced += delay
+            # In slices, so the write timeout bounds a stall rather than the whole file.
+            step = self.limits.slice_bytes
+            for part in range(start, start + size, step):
+                part_size = min(step, start + size - part)
+                sent = await self._within_write(loop.sendfile(writer.transport, f, part, part_size))
+                if sent < part_size:
+                    return False
+                self._check_rate(watch, sent)
+        return True
+
+    async def _within_write(self, awaitable):
+        try:
+            return await asyncio.wait_for(awaitable, self.limits.write_timeout or None)
+        except asyncio.TimeoutError:
+            self.limits.drop("write")
+            raise
+
+    async def _drain(self, writer: asyncio.StreamWriter) -> None:
+        await self._within_write(writer.drain())
+
+    def _check_rate(self, watch: TransferWatch, nbytes: int) -> None:
+        if not watch.advance(nbytes):
+            self.limits.drop("slow")
+            raise asyncio.TimeoutError("client reading below --min-rate")
+
+    async def _stream_events(self, writer: asyncio.StreamWriter) -> int:
+        live = self.site.live_reload
+        build = None
+        sent = 0
+        try:
+            while True:
+                current = await live.wait_async(build, LIVE_RELOAD_HEARTBEAT)
+                chunk = live.event(current) if current != build else b": ping\n\n"
+                build = current
+                writer.write(chunk)
+                await self._drain(writer)
+                sent += len(chunk)
+        except ConnectionError:
+            return sent
+
+    def _write_head(
+        self,
+        writer: asyncio.StreamWriter,
+        version: str,
+        status: int,
+        headers: list[tuple[str, str]],
+        keep_alive: bool,
+    ) -> None:
+        reason = http.HTTPStatus(status).phrase
+        lines = [
+            f"{version} {status} {reason}",
+            f"Server: {self.server_version}",
+            f"Date: {http_date(time.time())}",
+            *(f"{name}: {value}" for name, value in headers),
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1", "strict"))
+
+    async def _send_simple_error(
+        self,
+        writer: asyncio.StreamWriter,
+        version: str,
+        status: int,
+        message: str,
+        method: str = "GET",
+        keep_alive: bool = False,
+    ) -> None:
+        short, explain = SPAHandler.responses.get(status, ("???", "???"))
+        body = (
+            SPAHandler.error_message_format
+            % {"code": status, "message": html.escape(message, quote=False), "explain": html.escape(explain)}
+        ).encode("utf-8", "replace")
+        headers = [("Content-Type", SPAHandler.error_content_type), ("Content-Length", str(len(body)))]
+        self._write_head(writer, version, status, headers, keep_alive)
+        if method != "HEAD":
+            writer.write(body)
+        await self._drain(writer)
+        if self.site.access_log is not None:
+            peer = peer_label(writer.get_extra_info("peername"))
+            if status >= 500:
+                self.site.access_log.message("error", f"code {status}, message {message}")
+            if status != 404:
+                # 404s come from SPASite and are logged through record().
+                self.site.access_log.access({"client": peer, "status": status, "route": "internal"})
+
+
+# Socket activation passes listeners from this fd up (sd_listen_fds(3)).
+LISTEN_FDS_START = 3
+
+
+def make_listener(
+    host: str, port: int, *, backlog: int = 512, reuse_port: bool = False, listen: bool = True
+) -> socket.socket:
+    """Bind a TCP socket for host:port that either engine can serve from."""
+    family, type_, proto, _, address = socket.getaddrinfo(
+        host, port, type=socket.SOCK_STREAM, flags=socket.AI_PASSIVE
+    )[0]
+    sock = socket.socket(family, type_, proto)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(address)
+        if listen:
+            sock.listen(backlog)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def make_unix_listener(path: Path, *, backlog: int = 512) -> socket.socket:
+    """Bind a Unix domain socket at path, replacing a stale one left by a crash."""
+    if path.is_socket():
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(str(path))
+        except ConnectionRefusedError:
+            path.unlink()
+        else:
+            raise OSError(errno.EADDRINUSE, f"Another server is listening on {path}")
+        finally:
+            probe.close()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.bind(str(path))
+        sock.listen(backlog)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def inherited_listener() -> socket.socket | None:
+    """Adopt a listening socket passed by socket activation (systemd's LISTEN_FDS protocol).
+
+    The socket outlives this process, so connections arriving during a
+    restart queue in its backlog instead of being refused.
+    """
+    if os.environ.get("LISTEN_PID") != str(os.getpid()):
+        return None
+    count = int(os.environ.get("LISTEN_FDS") or 0)
+    # Not meant for children, who would otherwise try to adopt it too.
+    for name in ("LISTEN_PID", "LISTEN_FDS", "LISTEN_FDNAMES"):
+        os.environ.pop(name, None)
+    if count < 1:
+        return None
+    sock = socket.socket(fileno=LISTEN_FDS_START)
+    if sock.type != socket.SOCK_STREAM or not sock.getsockopt(socket.SOL_SOCKET, socket.SO_ACCEPTCONN):
+        sock.detach()
+        raise SystemExit(f"Inherited fd {LISTEN_FDS_START} is not a listening stream socket")
+    return sock
+
+
+def is_unix_socket(sock: socket.socket) -> bool:
+    return sock.family == getattr(socket, "AF_UNIX", None)
+
+
+def listener_address(sock: socket.socket) -> str:
+    """Where a listener can be reached, for the startup banner."""
+    if is_unix_socket(sock):
+        return f"unix:{sock.getsockname()}"
+    host, port = sock.getsockname()[:2]
+    return f"http://{host}:{port}"
+
+
+def peer_label(address) -> str:
+    """Client address for logs; Unix-socket peers are usually unnamed ("")."""
+    if address is None:
+        return "-"
+    if isinstance(address, tuple):
+        return str(address[0])
+    return address or "unix"
+
+
+def adopt_listener(httpd: socketserver.TCPServer, sock: socket.socket) -> None:
+    """Point a server built with bind_and_activate=False at a bound socket."""
+    httpd.socket.close()
+    httpd.socket = sock
+    if is_unix_socket(sock):
+        httpd.server_address = sock.getsockname()
+        httpd.server_name, httpd.server_port = "localhost", 0
+        return
+    httpd.server_address = sock.getsockname()[:2]
+    # What HTTPServer.server_bind() would set, minus its reverse DNS lookup.
+    httpd.server_name, httpd.server_port = httpd.server_address
+
+
+class Supervisor:
+    """Forks worker processes that share one port and keeps them running.
+
+    Workers run in their own process group so a terminal Ctrl-C reaches them
+    once, through the supervisor. SIGINT/SIGTERM are forwarded and stop the
+    pool; SIGHUP is forwarded and each worker is restarted after it drains,
+    which is a cheap way to drop caches after a rebuild. Workers that exit
+    for any other reason are restarted, with backoff if they die on startup.
+
+    Workers call listening() once they accept connections; on_ready runs in
+    the supervisor when count workers have, so a startup banner printed
+    there is a real readiness signal.
+    """
+
+    def __init__(
+        self, count: int, run_worker: Callable[[], int], on_ready: Callable[[], None] | None = None
+    ) -> None:
+        self.count = count
+        self.run_worker = run_worker
+        self.on_ready = on_ready
+        self.restarts = 0
+        self._children: dict[int, float] = {}
+        self._stopping = False
+        self._backoff = 0.0
+        self._ready_r, self._ready_w = os.pipe()
+
+    def listening(self) -> None:
+        """Called in a worker once its listener accepts connections."""
+        os.write(self._ready_w, b".")
+
+    def _await_ready(self) -> None:
+        # Restarted workers report too; keep draining so their writes never block.
+        seen = 0
+        while chunk := os.read(self._ready_r, 64):
+            if seen < self.count <= seen + len(chunk) and self.on_ready is not None:
+                self.on_ready()
+            seen += len(chunk)
+
+    def run(self) -> int:
+        for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+            signal.signal(signum, self._forward)
+        threading.Thread(target=self._await_ready, name="spa-supervisor-ready", daemon=True).start()
+        for _ in range(self.count):
+            self._spawn()
+        while self._children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            started = self._children.pop(pid, None)
+            if started is None or self._stopping:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            if code not in (0, -signal.SIGHUP):
+                print(f"Worker {pid} exited with status {code}; restarting", flush=True)
+            if time.monotonic() - started < 1.0:
+                self._backoff = min(max(self._backoff * 2, 0.1), 5.0)
+                time.sleep(self._backoff)
+            else:
+                self._backoff = 0.0
+            if not self._stopping:
+                self.restarts += 1
+                self._spawn()
+        return 0
+
+    def _spawn(self) -> None:
+        pid = os.fork()
+        if pid:
+            self._children[pid] = time.monotonic()
+            return
+        code = 1
+        try:
+            os.setpgid(0, 0)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            # Both end in a clean shutdown; the supervisor decides on restarts.
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+            signal.signal(signal.SIGHUP, signal.default_int_handler)
+            code = self.run_worker()
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    def _forward(self, signum: int, frame) -> None:
+        if signum != signal.SIGHUP:
+            self._stopping = True
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+
+def serve(
+    args: argparse.Namespace,
+    root: Path,
+    precompress_dir: Path | None,
+    sock: socket.socket,
+    *,
+    announce: bool = True,
+    on_ready: Callable[[], None] | None = None,
+) -> int:
+    """Build the site for this process and serve it on sock until interrupted."""
+    builds = None
+    if args.snapshots:
+        store = Path(args.snapshot_dir).resolve() if args.snapshot_dir else default_snapshot_dir(root)
+        # Unresolved, so a symlinked root is followed on every request.
+        source = Path(os.path.abspath(args.root))
+        builds = BuildSnapshots(source, store, keep=args.keep_builds, interval=args.index_interval)
+    bundle = PackedBundle(root, interval=args.index_interval) if args.bundle else None
+    index = None
+    if args.index and bundle is None:
+        extra_roots = [precompress_dir] if precompress_dir is not None and precompress_dir.is_dir() else []
+        if builds is not None:
+            index = FileIndex([*builds.roots(), *extra_roots], interval=args.index_interval)
+            builds.on_change.append(lambda: index.retarget([*builds.roots(), *extra_roots]))
+        else:
+            index = FileIndex([root, *extra_roots], interval=args.index_interval)
+    metrics = Metrics() if args.metrics else None
+    proxy = None
+    if args.proxy:
+        proxy = ReverseProxy(args.proxy, pool_size=args.proxy_pool, timeout=args.proxy_timeout, metrics=metrics)
+    live_reload = None
+    if args.live_reload:
+        live_reload = LiveReload(root, current_root=builds.current if builds is not None else None)
+        if builds is not None:
+            builds.on_change.append(live_reload.check)
+        elif index is not None:
+            live_reload.on_change.append(lambda: index.refresh(force=True))
+    log_stream = open(args.log_file, "a", encoding="utf-8") if args.log_file else sys.stdout
+    recorder = None
+    if args.record:
+        record_path = Path(args.record)
+        if args.processes > 1:
+            # One trace per worker; replay_spa_preview.py merges them by time.
+            stem, dot, suffixes = record_path.name.partition(".")
+            record_path = record_path.with_name(f"{stem}-{os.getpid()}{dot}{suffixes}")
+        recorder = TraceRecorder(record_path)
+    images = None
+    if args.resize_images:
+        image_dir = Path(args.image_cache_dir).resolve() if args.image_cache_dir else default_image_cache_dir(root)
+        images = ImageResizer(
+            image_dir, max_bytes=int(args.image_cache_mb * 1024 * 1024), workers=max(1, args.image_workers)
+        )
+    access_log = AccessLog(log_stream, sample=min(1.0, max(0.0, args.log_sample)), quiet=args.quiet)
+    site = SPASite(
+        root,
+        cache=AssetCache(int(args.cache_mb * 1024 * 1024)) if args.cache_mb > 0 else None,
+        sendfile_threshold=max(0, args.sendfile_threshold),
+        precompress_dir=precompress_dir,
+        cache_policy=args.cache_policy,
+        index=index,
+        metrics=metrics,
+        access_log=access_log,
+        preload=(
+            PreloadHints(bundle.read_bytes if bundle is not None else Path.read_bytes)
+            if args.preload_hints or args.early_hints
+            else None
+        ),
+        early_hints=args.early_hints,
+        live_reload=live_reload,
+        builds=builds,
+        proxy=proxy,
+        profiles=dict(args.profile),
+        bundle=bundle,
+        recorder=recorder,
+        images=images,
+        inliner=(
+            ShellInliner(int(args.inline_kb * 1024), bundle.read_bytes if bundle is not None else Path.read_bytes)
+            if args.inline_kb > 0
+            else None
+        ),
+    )
+    limits = ConnectionLimits(
+        header_timeout=args.header_timeout,
+        idle_timeout=args.keep_alive_timeout,
+        write_timeout=args.write_timeout,
+        min_rate=max(0.0, args.min_rate),
+    )
+    if metrics is not None:
+        metrics.add_source("dropped_connections", limits.stats)
+        if site.cache is not None:
+            metrics.add_source("cache", site.cache.stats)
+        if index is not None:
+            metrics.add_source("index", index.stats)
+        if bundle is not None:
+            metrics.add_source("bundle", bundle.stats)
+        metrics.add_source("access_log", lambda: {"dropped": access_log.dropped})
+        if recorder is not None:
+            metrics.add_source("trace", recorder.stats)
+        if images is not None:
+            metrics.add_source("images", images.stats)
+        if site.inliner is not None:
+            metrics.add_source("inline_shell", site.inliner.stats)
+        if live_reload is not None:
+            metrics.add_source("live_reload", live_reload.stats)
+        if builds is not None:
+            metrics.add_source("builds", builds.stats)
+        if proxy is not None:
+            metrics.add_source("proxy", proxy.stats)
+
+    def ready(engine: str = "") -> None:
+        # Flushed so wrappers (e.g. bench_spa_preview.py) can read the bound port.
+        if on_ready is not None:
+            on_ready()
+        if announce:
+            print(f"SPA preview server running on {listener_address(sock)} (root={root}{engine})", flush=True)
+
+    try:
+        if args.engine == "asyncio":
+            server = AsyncSPAServer(
+                site,
+                keep_alive_timeout=args.keep_alive_timeout,
+                io_threads=args.io_threads,
+                limits=limits,
+                drain_timeout=args.drain_timeout,
+            )
+            stop_signals = tuple(
+                signum
+                for signum in (signal.SIGTERM, getattr(signal, "SIGHUP", None))
+                if signum is not None and signal.getsignal(signum) is signal.default_int_handler
+            )
+            asyncio.run(server.serve(sock, lambda: ready(", engine=asyncio"), stop_signals))
+        else:
+            handler = SPAHandler
+            handler.site = site
+            handler.limits = limits
+            handler.connections = OpenConnections()
+            if args.keep_alive_timeout > 0:
+                handler.protocol_version = "HTTP/1.1"
+            if args.workers > 0:
+                httpd = PooledHTTPServer(
+                    (args.host, args.port),
+                    handler,
+                    workers=args.workers,
+                    queue_depth=args.queue_depth,
+                    retry_after=args.retry_after,
+                    bind_and_activate=False,
+                )
+                if metrics is not None:
+                    metrics.add_source("pool", httpd.stats)
+            else:
+                httpd = http.server.ThreadingHTTPServer((args.host, args.port), handler, bind_and_activate=False)
+            adopt_listener(httpd, sock)
+            with httpd:
+                ready()
+                try:
+                    httpd.serve_forever()
+                finally:
+                    # Stop accepting first, then let in-flight responses finish.
+                    httpd.server_close()
+                    cut = handler.connections.drain(args.drain_timeout)
+                    if cut:
+                        print(f"Connections cut off by the drain timeout: {cut}")
+                    if isinstance(httpd, PooledHTTPServer):
+                        print(f"Connections shed with 503: {httpd.shed}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if live_reload is not None:
+            live_reload.close()
+        if images is not None:
+            images.close()
+        if recorder is not None:
+            recorder.close()
+            print(f"Recorded {recorder.recorded} request(s) to {recorder.path} ({recorder.dropped} dropped)")
+        access_log.close()
+        if log_stream is not sys.stdout:
+            log_stream.close()
+        if access_log.dropped:
+            print(f"Access log records dropped: {access_log.dropped}")
+        if site.cache is not None:
+            print(f"Asset cache stats: {site.cache.stats()}")
+        if index is not None:
+            print(f"File index stats: {index.stats()}")
+        if bundle is not None:
+            print(f"Bundle stats: {bundle.stats()}")
+    return 0
 
 
 def main() -> int:
@@ -80,18 +3914,364 @@ def main() -> int:
     parser.add_argument("--root", default="dist", help="Directory to serve (default: dist)")
     parser.add_argument("--host", default="127.0.0.1", help="Host to bind (default: 127.0.0.1)")
     parser.add_argument("--port", type=int, default=4173, help="Port to bind (default: 4173)")
+    parser.add_argument(
+        "--unix",
+        metavar="PATH",
+        help=(
+            "Listen on a Unix domain socket instead of --host/--port, e.g. for a local nginx or Caddy; "
+            "a listener inherited through LISTEN_FDS (socket activation) takes precedence over both"
+        ),
+    )
+    parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=10.0,
+        help="On shutdown, seconds to let in-flight responses finish after closing the listener (default: 10)",
+    )
+    parser.add_argument(
+        "--cache-mb",
+        type=float,
+        default=0,
+        help="In-memory file cache budget in MiB; 0 disables caching (default: 0)",
+    )
+    parser.add_argument(
+        "--sendfile-threshold",
+        type=int,
+        default=256 * 1024,
+        help="Stream files of at least this many bytes with sendfile (default: 262144)",
+    )
+    parser.add_argument(
+        "--precompress",
+        action="store_true",
+        help="Precompress compressible files into --precompress-dir before serving",
+    )
+    parser.add_argument(
+        "--precompress-dir",
+        help="Directory for precompressed variants (default: a per-root temp directory)",
+    )
+    parser.add_argument(
+        "--cache-policy",
+        choices=("no-store", "immutable"),
+        default="no-store",
+        help=(
+            "no-store: never cache anything (default). immutable: cache hashed assets for a "
+            "year, revalidate other files with ETag/Last-Modified, keep index.html no-store"
+        ),
+    )
+    parser.add_argument(
+        "--pack",
+        metavar="FILE",
+        help=(
+            "Write --root, plus any --precompress variants, into one indexed archive and exit; "
+            "serve it later with --bundle"
+        ),
+    )
+    parser.add_argument(
+        "--bundle",
+        metavar="FILE",
+        help=(
+            "Serve from a --pack archive instead of --root: one memory-mapped file, so lookups and "
+            "reads never touch the filesystem (a replaced archive is remapped)"
+        ),
+    )
+    parser.add_argument(
+        "--resize-images",
+        action="store_true",
+        help=(
+            "Serve resized variants of PNG/JPEG/WebP files for ?w=, ?h= and ?q= (downscale only, "
+            "aspect kept), made in a process pool and cached on disk; needs Pillow"
+        ),
+    )
+    parser.add_argument(
+        "--image-cache-mb",
+        type=float,
+        default=256,
+        help="Disk budget for resized image variants in MiB (default: 256)",
+    )
+    parser.add_argument(
+        "--image-cache-dir",
+        help="Directory for resized image variants (default: a per-root temp directory)",
+    )
+    parser.add_argument(
+        "--image-workers",
+        type=int,
+        default=2,
+        help="Processes decoding and encoding resized images (default: 2)",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=("threaded", "asyncio"),
+        default="threaded",
+        help="threaded: ThreadingHTTPServer (default). asyncio: asyncio streams server",
+    )
+    parser.add_argument(
+        "--keep-alive-timeout",
+        type=float,
+        default=5.0,
+        help="Seconds an idle keep-alive connection stays open; 0 disables keep-alive (default: 5)",
+    )
+    parser.add_argument(
+        "--header-timeout",
+        type=float,
+        default=10.0,
+        help=(
+            "Seconds a client gets to send a whole request head (and any proxied body), counted from "
+            "the connection or the request's first byte; 0 disables (default: 10)"
+        ),
+    )
+    parser.add_argument(
+        "--write-timeout",
+        type=float,
+        default=30.0,
+        help="Seconds a response write may make no progress before the client is dropped; 0 disables (default: 30)",
+    )
+    parser.add_argument(
+        "--min-rate",
+        type=float,
+        default=0,
+        help=(
+            f"Drop clients reading a response body slower than this many bytes/s once it has been "
+            f"flowing {MIN_RATE_GRACE:g}s (--profile pacing excluded); 0 disables (default: 0)"
+        ),
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help=(
+            "Fixed worker pool size for the threaded engine; 0 uses a thread per connection (default: 0). "
+            "Live-reload event streams run on their own threads outside the pool"
+        ),
+    )
+    parser.add_argument(
+        "--queue-depth",
+        type=int,
+        default=128,
+        help="Connections allowed to wait for a --workers thread before 503s are sent (default: 128)",
+    )
+    parser.add_argument(
+        "--retry-after",
+        type=int,
+        default=1,
+        help="Retry-After seconds sent with load-shedding 503 responses (default: 1)",
+    )
+    parser.add_argument(
+        "--io-threads",
+        type=int,
+        default=4,
+        help="File I/O threads for the asyncio engine (default: 4)",
+    )
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help=f"Serve Prometheus metrics at {METRICS_PATH} and add Server-Timing headers",
+    )
+    parser.add_argument(
+        "--log-sample",
+        type=float,
+        default=1.0,
+        help="Fraction of requests written to the access log (default: 1.0)",
+    )
+    parser.add_argument("--log-file", help="Append access logs to this file instead of stdout")
+    parser.add_argument("--quiet", action="store_true", help="Disable access logs; errors are still logged")
+    parser.add_argument(
+        "--record",
+        metavar="FILE",
+        help=(
+            "Append a request trace (timing, method, target, cache/range/encoding headers) for "
+            "replay_spa_preview.py; gzip-compressed when FILE ends in .gz"
+        ),
+    )
+    parser.add_argument(
+        "--preload-hints",
+        action="store_true",
+        help="Add Link modulepreload/preload headers for the entry chunks to index.html responses",
+    )
+    parser.add_argument(
+        "--early-hints",
+        action="store_true",
+        help="Also send the preload links as a 103 Early Hints response (implies --preload-hints)",
+    )
+    parser.add_argument(
+        "--inline-kb",
+        type=float,
+        default=0,
+        help=(
+            "Serve index.html with the stylesheets and scripts it loads up front inlined when at most "
+            "this many KiB; built once per build and kept in memory (default: 0, disabled)"
+        ),
+    )
+    parser.add_argument(
+        "--live-reload",
+        action="store_true",
+        help=(
+            f"Serve build-change events at {LIVE_RELOAD_PATH} and inject a client into index.html "
+            "that reloads open tabs after a rebuild"
+        ),
+    )
+    parser.add_argument(
+        "--snapshots",
+        action="store_true",
+        help=(
+            "Serve each request from one complete build: follow a symlinked --root per request, "
+            "or copy each settled build into --snapshot-dir and swap it in atomically"
+        ),
+    )
+    parser.add_argument(
+        "--keep-builds",
+        type=int,
+        default=2,
+        help=(
+            f"Previous --snapshots builds kept under {BUILDS_PREFIX}<id>/ and searched for "
+            "hashed assets the current build no longer has (default: 2)"
+        ),
+    )
+    parser.add_argument(
+        "--snapshot-dir",
+        help="Directory for --snapshots copies (default: a per-root temp directory)",
+    )
+    parser.add_argument(
+        "--proxy",
+        action="append",
+        type=parse_proxy_rule,
+        default=[],
+        metavar="PREFIX=URL",
+        help="Forward requests under PREFIX to a local backend, e.g. /api=http://127.0.0.1:8000 (repeatable)",
+    )
+    parser.add_argument(
+        "--proxy-pool",
+        type=int,
+        default=8,
+        help="Keep-alive connections per --proxy upstream; more requests wait for one (default: 8)",
+    )
+    parser.add_argument(
+        "--proxy-timeout",
+        type=float,
+        default=30.0,
+        help="Seconds to wait for a pooled connection or upstream response (default: 30)",
+    )
+    parser.add_argument(
+        "--profile",
+        action="append",
+        type=parse_profile,
+        default=[],
+        metavar="[ROUTE=]PROFILE",
+        help=(
+            f"Throttle responses to a network profile ({', '.join(NETWORK_PROFILES)} or custom:KBPS,RTT_MS): "
+            "bandwidth is paced per connection and each response waits one RTT before its first byte. "
+            f"Prefix a route class ({', '.join(THROTTLE_ROUTES)}) to shape only that class; without a "
+            "prefix it applies to all but internal. Repeatable; pair with Lighthouse's "
+            "--throttling-method=provided"
+        ),
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help=(
+            "Fork this many worker processes sharing the port (SO_REUSEPORT where available); "
+            "a supervisor restarts crashed workers. Caches and metrics are per process (default: 1)"
+        ),
+    )
+    parser.add_argument(
+        "--backlog",
+        type=int,
+        default=512,
+        help="Listen backlog for pending connections (default: 512)",
+    )
+    parser.add_argument(
+        "--index",
+        action="store_true",
+        help="Index the root at startup and route from memory instead of stat calls",
+    )
+    parser.add_argument(
+        "--index-interval",
+        type=float,
+        default=0.5,
+        help="Minimum seconds between rebuild checks of the --index (default: 0.5)",
+    )
     args = parser.parse_args()
+    if args.resize_images and Image is None:
+        parser.error("--resize-images needs Pillow (pip install Pillow)")
+
+    if args.bundle:
+        if args.snapshots or args.live_reload or args.precompress or args.precompress_dir or args.pack:
+            parser.error("--bundle serves a finished pack; drop --snapshots, --live-reload, --precompress and --pack")
+        root = Path(args.bundle).resolve()
+        try:
+            PackedBundle(root)
+        except (OSError, ValueError) as exc:
+            raise SystemExit(f"Cannot open bundle {root}: {exc}")
+    else:
+        root = Path(args.root).resolve()
+        if not root.exists() or not root.is_dir():
+            raise SystemExit(f"Root directory does not exist: {root}")
+
+    precompress_dir = None
+    if args.precompress or args.precompress_dir:
+        precompress_dir = (
+            Path(args.precompress_dir).resolve() if args.precompress_dir else default_precompress_dir(root)
+        )
+    if args.precompress:
+        written = precompress_tree(root, precompress_dir)
+        codings = "gzip, br" if brotli is not None else "gzip (install brotli for br)"
+        print(f"Precompressed {written} variant(s) [{codings}] into {precompress_dir}")
+
+    if args.pack:
+        out = Path(args.pack).resolve()
+        count = write_pack(root, out, precompress_dir)
+        print(f"Packed {count} file(s) into {out} ({out.stat().st_size} bytes)")
+        return 0
+
+    sock = inherited_listener()
+    unix_path = None
+    if sock is None and args.unix:
+        unix_path = Path(args.unix).resolve()
+        try:
+            sock = make_unix_listener(unix_path, backlog=args.backlog)
+        except OSError as exc:
+            raise SystemExit(f"Cannot listen on {unix_path}: {exc}")
+    try:
+        if args.processes > 1:
+            if not hasattr(os, "fork"):
+                raise SystemExit("--processes needs os.fork(); run a single process on this platform")
+            # With SO_REUSEPORT each worker gets its own accept queue and the
+            # kernel spreads connections; the supervisor only keeps the port
+            # reserved. Without it, or on a Unix or inherited socket, workers
+            # inherit one listening socket.
+            reuse_port = sock is None and hasattr(socket, "SO_REUSEPORT")
+            if sock is None:
+                sock = make_listener(
+                    args.host, args.port, backlog=args.backlog, reuse_port=reuse_port, listen=not reuse_port
+                )
+            address = listener_address(sock)
+            port = sock.getsockname()[1] if reuse_port else None
+
+            def run_worker() -> int:
+                listener = sock
+                if reuse_port:
+                    sock.close()
+                    listener = make_listener(args.host, port, backlog=args.backlog, reuse_port=True)
+                return serve(args, root, precompress_dir, listener, announce=False, on_ready=supervisor.listening)
 
-    root = Path(args.root).resolve()
-    if not root.exists() or not root.is_dir():
-        raise SystemExit(f"Root directory does not exist: {root}")
+            def ready() -> None:
+                # Flushed so wrappers (e.g. bench_spa_preview.py) can read the bound port.
+                print(f"SPA preview server running on {address} (root={root}, processes={args.processes})", flush=True)
 
-    handler = SPAHandler
-    handler.root = root
+            supervisor = Supervisor(args.processes, run_worker, on_ready=ready)
+            with sock:
+                supervisor.run()
+            print(f"Worker restarts: {supervisor.restarts}")
+            return 0
 
-    with http.server.ThreadingHTTPServer((args.host, args.port), handler) as httpd:
-        print(f"SPA preview server running on http://{args.host}:{args.port} (root={root})")
-        httpd.serve_forever()
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        if sock is None:
+            sock = make_listener(args.host, args.port, backlog=args.backlog)
+        return serve(args, root, precompress_dir, sock)
+    finally:
+        if unix_path is not None:
+            # Only this process created it; forked workers leave through os._exit().
+            unix_path.unlink(missing_ok=True)
 
 
 if __name__ == "__main__":